@@ -0,0 +1,310 @@
+# Offline benchmark of the download path. Starts a local fake video host serving synthetic
+# progressive MP4 files and DASH manifests (both handled by yt-dlp's generic extractor),
+# runs the API in-process on uvicorn against an in-memory MongoDB stand-in (or a local
+# mongod), and drives upload -> download-all -> list-files -> file downloads from many
+# sessions at once. Reports p50/p99 latency per endpoint, links/sec, event-loop lag and
+# peak RSS.
+#
+#   python benchmark.py --sessions 8 --links 25 --size 2000000 --dash 0.5
+#
+# Needs httpx, and mongomock-motor unless --mongo-uri is given. Nothing here talks to the
+# internet; platform pacing is lifted unless --pace is passed.
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import argparse
+import asyncio
+import json
+import os
+import resource
+import shutil
+import socket
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+SEGMENT_SIZE = 256 * 1024
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+# Deterministic filler bytes for a synthetic file, so any byte range can be produced
+# without keeping the file in memory
+def _payload(name: str, start: int, end: int) -> bytes:
+    block = (name.encode() * (4096 // max(1, len(name)) + 1))[:4096]
+    offset = start % len(block)
+    return (block * ((end - start) // len(block) + 2))[offset:offset + end - start]
+
+
+class FakeHostHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    size = 1_000_000
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, content_type: str, body: bytes, extra=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Accept-Ranges", "bytes")
+        for name, value in (extra or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _send_file(self, name: str, size: int, content_type: str):
+        start, end = 0, size
+        status, extra = 200, {}
+        range_header = self.headers.get("Range")
+        if range_header and range_header.startswith("bytes="):
+            first, _, last = range_header[6:].partition("-")
+            start = int(first or 0)
+            end = min(size, int(last) + 1) if last else size
+            status, extra = 206, {"Content-Range": f"bytes {start}-{end - 1}/{size}"}
+        self._send(status, content_type, _payload(name, start, end), extra)
+
+    # /p/<id>.mp4          progressive file
+    # /d/<id>.mpd          DASH manifest with one muxed representation, titled <id>
+    # /d/<id>/init.mp4     DASH initialization segment
+    # /d/<id>/seg-<n>.m4s  DASH media segments
+    def do_GET(self):
+        path = self.path.split("?", 1)[0]
+        parts = path.strip("/").split("/")
+        if len(parts) == 2 and parts[0] == "p" and parts[1].endswith(".mp4"):
+            return self._send_file(parts[1], self.size, "video/mp4")
+        if len(parts) == 2 and parts[0] == "d" and parts[1].endswith(".mpd"):
+            segments = max(1, -(-self.size // SEGMENT_SIZE))
+            return self._send(200, "application/dash+xml", self._manifest(parts[1][:-4], segments).encode())
+        if len(parts) == 3 and parts[0] == "d":
+            if parts[2] == "init.mp4":
+                return self._send(200, "video/mp4", _payload(parts[1] + "init", 0, 1024))
+            if parts[2].startswith("seg-"):
+                index = int(parts[2][4:].split(".")[0])
+                start = (index - 1) * SEGMENT_SIZE
+                return self._send_file(parts[1] + parts[2], min(SEGMENT_SIZE, self.size - start), "video/iso.segment")
+        self._send(404, "text/plain", b"not found")
+
+    do_HEAD = do_GET
+
+    def _manifest(self, video_id: str, segments: int) -> str:
+        duration = segments * 2
+        return f"""<?xml version="1.0" encoding="UTF-8"?>
+<MPD xmlns="urn:mpeg:dash:schema:mpd:2011" type="static" mediaPresentationDuration="PT{duration}S" minBufferTime="PT2S" profiles="urn:mpeg:dash:profile:isoff-on-demand:2011">
+  <Period>
+    <AdaptationSet mimeType="video/mp4" segmentAlignment="true">
+      <Representation id="muxed" codecs="avc1.4d401f,mp4a.40.2" bandwidth="1000000" width="1280" height="720">
+        <SegmentTemplate timescale="1" duration="2" initialization="{video_id}/init.mp4" media="{video_id}/seg-$Number$.m4s" startNumber="1"/>
+      </Representation>
+    </AdaptationSet>
+  </Period>
+</MPD>
+"""
+
+
+def start_fake_host(size: int):
+    handler = type("Handler", (FakeHostHandler,), {"size": size})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="fake-host", daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+# Point every collection the app uses at db
+def use_database(main, db):
+    main.db = db
+    for name in ("links", "downloads", "files", "jobs", "queue", "metadata", "names"):
+        setattr(main, f"{name}_collection", db[name])
+    main.downloads_writer.collection = db["downloads"]
+    main.files_writer.collection = db["files"]
+    main.job_manager.collection = db["jobs"]
+    main.job_manager.queue = db["queue"]
+    main.metadata_cache.collection = db["metadata"]
+
+
+class EventLoopMonitor:
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.lags = []
+        self._task = None
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.lags.append(max(0.0, time.perf_counter() - started - self.interval))
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        self._task.cancel()
+
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+
+async def run_session(client, host: str, args, timings: dict, counts: dict, index: int):
+    import httpx
+
+    cookies = {"Cookie": f"session_id=bench-{index}-{uuid.uuid4().hex[:8]}"}
+
+    async def timed(name, method, url, **kwargs):
+        started = time.perf_counter()
+        response = await client.request(method, url, headers=cookies, **kwargs)
+        timings.setdefault(name, []).append(time.perf_counter() - started)
+        if response.status_code >= 400:
+            counts["errors"] += 1
+            raise httpx.HTTPStatusError(f"{name} returned {response.status_code}: {response.text[:200]}", request=response.request, response=response)
+        return response
+
+    links = []
+    for n in range(args.links):
+        video_id = f"s{index}v{n}"
+        if n < args.links * args.dash:
+            links.append(f"{host}/d/{video_id}.mpd")
+        else:
+            links.append(f"{host}/p/{video_id}.mp4")
+    sheet = "video_link\n" + "\n".join(links) + "\n"
+    await timed("upload", "POST", "/upload-excel/", files={"file": ("links.csv", sheet.encode(), "text/csv")})
+    response = await timed("download_all", "POST", "/download-all/", timeout=None)
+    results = response.json()["results"]
+    counts["links"] += len(results)
+    counts["failed"] += sum(1 for r in results if r["status"] != "success")
+    files = (await timed("list_files", "GET", "/downloads/list-files/")).json()["files"]
+    for f in files[:args.fetch]:
+        response = await timed("file", "GET", f"/downloads/file/{f['name']}")
+        counts["bytes_served"] += len(response.content)
+
+
+async def run(args):
+    import httpx
+    import uvicorn
+
+    workdir = tempfile.mkdtemp(prefix="downloader-bench-")
+    os.chdir(workdir)
+    os.environ.setdefault("CACHE_FOLDER", os.path.join(workdir, "cache"))
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+    sys.path.insert(0, BACKEND_DIR)
+    fake_host, host = start_fake_host(args.size)
+
+    import main
+    if args.mongo_uri:
+        from motor.motor_asyncio import AsyncIOMotorClient
+        db = AsyncIOMotorClient(args.mongo_uri)[f"bench_{uuid.uuid4().hex[:8]}"]
+    else:
+        try:
+            from mongomock_motor import AsyncMongoMockClient
+        except ImportError:
+            sys.exit("mongomock-motor is not installed; pip install mongomock-motor or pass --mongo-uri")
+        db = AsyncMongoMockClient()["video_downloader"]
+    use_database(main, db)
+    if not args.pace:
+        unlimited = {"rate": 1e9, "burst": 1e9, "retries": 1}
+        main.rate_limiter.limits = {platform: unlimited for platform in main.rate_limiter.limits}
+
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=port, log_level="warning", lifespan="on"))
+    serving = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+
+    timings, counts = {}, {"links": 0, "failed": 0, "errors": 0, "bytes_served": 0}
+    monitor = EventLoopMonitor()
+    monitor.start()
+    started = time.perf_counter()
+    limits = httpx.Limits(max_connections=args.sessions * 2)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=60) as client:
+        outcomes = await asyncio.gather(
+            *[run_session(client, host, args, timings, counts, i) for i in range(args.sessions)],
+            return_exceptions=True,
+        )
+    elapsed = time.perf_counter() - started
+    monitor.stop()
+
+    server.should_exit = True
+    await serving
+    fake_host.shutdown()
+    if args.mongo_uri:
+        await db.client.drop_database(db.name)
+
+    report = {
+        "sessions": args.sessions,
+        "links_per_session": args.links,
+        "file_size": args.size,
+        "elapsed_seconds": round(elapsed, 3),
+        "links": counts["links"],
+        "failed_links": counts["failed"],
+        "http_errors": counts["errors"],
+        "session_errors": [str(o) for o in outcomes if isinstance(o, Exception)],
+        "links_per_second": round(counts["links"] / elapsed, 2) if elapsed else 0,
+        "bytes_served": counts["bytes_served"],
+        "latency_ms": {
+            name: {
+                "count": len(values),
+                "p50": round(percentile(values, 50) * 1000, 1),
+                "p99": round(percentile(values, 99) * 1000, 1),
+                "mean": round(statistics.fmean(values) * 1000, 1),
+            }
+            for name, values in timings.items()
+        },
+        "event_loop_lag_ms": {
+            "p50": round(percentile(monitor.lags, 50) * 1000, 2),
+            "p99": round(percentile(monitor.lags, 99) * 1000, 2),
+            "max": round(max(monitor.lags, default=0) * 1000, 2),
+        },
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+    if not args.keep:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return report
+
+
+def print_report(report: dict):
+    print(f"{report['links']} links from {report['sessions']} sessions in {report['elapsed_seconds']}s "
+          f"({report['links_per_second']} links/s), {report['failed_links']} failed, {report['http_errors']} HTTP errors")
+    print(f"{'endpoint':<14}{'count':>7}{'p50 ms':>10}{'p99 ms':>10}{'mean ms':>10}")
+    for name, stats in report["latency_ms"].items():
+        print(f"{name:<14}{stats['count']:>7}{stats['p50']:>10}{stats['p99']:>10}{stats['mean']:>10}")
+    lag = report["event_loop_lag_ms"]
+    print(f"event loop lag: p50 {lag['p50']} ms, p99 {lag['p99']} ms, max {lag['max']} ms")
+    print(f"peak RSS: {report['peak_rss_mb']} MB")
+    for error in report["session_errors"]:
+        print(f"session error: {error}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmark of the download path")
+    parser.add_argument("--sessions", type=int, default=4, help="concurrent sessions, each with its own upload")
+    parser.add_argument("--links", type=int, default=20, help="links per session (batch size)")
+    parser.add_argument("--size", type=int, default=1_000_000, help="bytes per synthetic video")
+    parser.add_argument("--dash", type=float, default=0.25, help="share of links served as DASH manifests")
+    parser.add_argument("--fetch", type=int, default=5, help="files downloaded back per session")
+    parser.add_argument("--mongo-uri", help="use a real MongoDB (a throwaway database is created and dropped)")
+    parser.add_argument("--pace", action="store_true", help="keep the per-platform rate limits")
+    parser.add_argument("--keep", action="store_true", help="keep the work directory")
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+    if args.json:
+        args.json = os.path.abspath(args.json)
+
+    report = asyncio.run(run(args))
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,309 @@
+from collections import OrderedDict
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import shutil
+import time
+import uuid
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process locks, so give each worker its own CACHE_FOLDER
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+CACHE_FOLDER = os.getenv("CACHE_FOLDER", "cache")
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", 20 * 1024 * 1024 * 1024))  # 20GB shared by all sessions
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", 10000))
+CACHE_RESCAN_INTERVAL = int(os.getenv("CACHE_RESCAN_INTERVAL", 60))  # seconds between budget checks against the folder
+CACHE_TMP_MAX_AGE = int(os.getenv("CACHE_TMP_MAX_AGE", 3600))  # older temp directories are left over from a crash
+CACHE_LOCK_POLL = 0.5  # seconds between checks while another worker downloads the same key
+
+META_FILE = "meta.json"
+EVICT_LOCK = ".evict.lock"
+
+
+def cache_key(identity: str, format_spec: str) -> str:
+    return hashlib.sha256(f"{identity}|{format_spec}".encode()).hexdigest()
+
+
+def _link_or_copy(src: str, dst: str):
+    if os.path.exists(dst):
+        os.remove(dst)
+    try:
+        os.link(src, dst)
+    except OSError:
+        # Different filesystem or no hard link support
+        shutil.copy2(src, dst)
+
+
+# Exclusive lock on path without waiting. Returns the open file holding it, to be closed to
+# release it, or None when another process holds it. Without fcntl every lock is granted.
+def _try_lock(path: str):
+    lock_file = open(path, "a")
+    if fcntl is None:
+        return lock_file
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock_file.close()
+        return None
+    return lock_file
+
+
+# Content-addressed store of finished downloads shared by every session. Each entry is a
+# directory named after its key holding the downloaded files and a meta.json; sessions get
+# hard links to those files, so evicting an entry never breaks a session's copy. Entries
+# are evicted least recently used first once the size or entry budget is exceeded.
+#
+# Every worker process on a host may share one CACHE_FOLDER. The folder is the source of
+# truth: entries stored by other workers are picked up from disk on a miss, meta.json
+# mtimes carry the LRU order, and the budget is enforced against a scan of the folder by
+# one worker at a time. A download in progress holds a lock file for its key, so other
+# workers wait for it instead of fetching the same video.
+class DownloadCache:
+    def __init__(self, root: str = CACHE_FOLDER, max_bytes: int = CACHE_MAX_BYTES, max_entries: int = CACHE_MAX_ENTRIES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> meta, least recently used first
+        self._size = 0
+        self._inflight = {}  # key -> asyncio.Future of a download in progress in this process
+        self._loaded = False
+        self._scanned_at = 0.0
+        self._lock = asyncio.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _entry_dir(self, key: str) -> str:
+        return os.path.join(self.root, key[:2], key)
+
+    def _lock_path(self, key: str) -> str:
+        return f"{self._entry_dir(key)}.lock"
+
+    def _read_meta(self, key: str):
+        try:
+            with open(os.path.join(self._entry_dir(key), META_FILE)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    # Read every entry from the folder, least recently used first, and clear out what
+    # crashed writers left behind
+    def _scan(self) -> OrderedDict:
+        entries = []
+        stale = time.time() - CACHE_TMP_MAX_AGE
+        if os.path.isdir(self.root):
+            for shard in os.scandir(self.root):
+                if not shard.is_dir():
+                    continue
+                for entry in os.scandir(shard.path):
+                    if entry.name.endswith(".lock"):
+                        continue
+                    try:
+                        if entry.name.endswith(".tmp"):
+                            # Another worker may still be writing a fresh one
+                            if entry.stat().st_mtime < stale:
+                                shutil.rmtree(entry.path, ignore_errors=True)
+                            continue
+                        meta_path = os.path.join(entry.path, META_FILE)
+                        try:
+                            with open(meta_path) as f:
+                                meta = json.load(f)
+                            entries.append((os.stat(meta_path).st_mtime, entry.name, meta))
+                        except (OSError, ValueError):
+                            # Half-written entry from a crash
+                            if entry.stat().st_mtime < stale:
+                                shutil.rmtree(entry.path, ignore_errors=True)
+                    except FileNotFoundError:
+                        # Renamed or evicted by another worker while we looked
+                        continue
+        return OrderedDict((key, meta) for _, key, meta in sorted(entries, key=lambda e: e[0]))
+
+    def _adopt(self, entries: OrderedDict):
+        self._entries = entries
+        self._size = sum(meta["size"] for meta in entries.values())
+        self._scanned_at = time.monotonic()
+
+    async def load(self):
+        async with self._lock:
+            if not self._loaded:
+                self._adopt(await asyncio.to_thread(self._scan))
+                self._loaded = True
+                logger.info(f"Loaded {len(self._entries)} cache entries ({self._size} bytes) from {self.root}")
+
+    # The entry's meta, from memory or, for entries other workers stored, from disk
+    async def _lookup(self, key: str):
+        await self.load()
+        meta = self._entries.get(key)
+        if meta is None:
+            meta = await asyncio.to_thread(self._read_meta, key)
+            if meta is not None:
+                self._entries[key] = meta
+                self._size += meta["size"]
+        return meta
+
+    # Hard-link a cached entry into dest_dir. Returns the saved file records, or None on a miss.
+    async def fetch(self, key: str, dest_dir: str):
+        meta = await self._lookup(key)
+        if meta is None:
+            return None
+        entry_dir = self._entry_dir(key)
+
+        def _materialize():
+            os.makedirs(dest_dir, exist_ok=True)
+            for saved in meta["files"]:
+                _link_or_copy(os.path.join(entry_dir, saved["filename"]), os.path.join(dest_dir, saved["filename"]))
+            os.utime(os.path.join(entry_dir, META_FILE))  # keeps LRU order across workers and restarts
+
+        try:
+            await asyncio.to_thread(_materialize)
+        except OSError as e:
+            # Unreadable, or evicted by another worker since it was indexed here
+            logger.warning(f"Dropping unusable cache entry {key}: {str(e)}")
+            self._forget(key)
+            return None
+        self._entries.move_to_end(key)
+        return [dict(saved) for saved in meta["files"]]
+
+    # Paths of a cached entry's files, for serving them straight from the cache, or None.
+    # Another worker may still evict the entry before the caller opens them.
+    async def paths(self, key: str):
+        meta = await self._lookup(key)
+        paths = None
+        if meta is not None:
+            paths = [os.path.join(self._entry_dir(key), saved["filename"]) for saved in meta["files"]]
+            if not await asyncio.to_thread(all, map(os.path.exists, paths)):
+                # Evicted by another worker since it was indexed here
+                self._forget(key)
+                paths = None
+        if paths is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return paths
+
+    async def store(self, key: str, src_dir: str, saved_files: list, link: str):
+        if not saved_files:
+            return
+        await self.load()
+        entry_dir = self._entry_dir(key)
+        meta = {"link": link, "files": saved_files, "size": sum(f["size"] for f in saved_files), "stored_at": time.time()}
+
+        def _write():
+            # Unique per writer, so workers storing the same key never share a temp directory
+            tmp_dir = f"{entry_dir}.{os.getpid()}-{uuid.uuid4().hex[:8]}.tmp"
+            os.makedirs(tmp_dir)
+            try:
+                for saved in saved_files:
+                    _link_or_copy(os.path.join(src_dir, saved["filename"]), os.path.join(tmp_dir, saved["filename"]))
+                with open(os.path.join(tmp_dir, META_FILE), "w") as f:
+                    json.dump(meta, f)
+                shutil.rmtree(entry_dir, ignore_errors=True)
+                try:
+                    os.rename(tmp_dir, entry_dir)
+                except OSError:
+                    if not os.path.exists(os.path.join(entry_dir, META_FILE)):
+                        raise
+                    # Another worker stored the same key in between; its entry is as good
+            finally:
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+
+        try:
+            await asyncio.to_thread(_write)
+        except OSError as e:
+            logger.error(f"Failed to store {link} in the download cache: {str(e)}")
+            return
+        self._forget(key)
+        self._entries[key] = meta
+        self._size += meta["size"]
+        logger.info(f"Cached {link} as {key} ({meta['size']} bytes)")
+        over = self._size > self.max_bytes or len(self._entries) > self.max_entries
+        if over or time.monotonic() - self._scanned_at > CACHE_RESCAN_INTERVAL:
+            await self._enforce_budget()
+
+    def _forget(self, key: str):
+        meta = self._entries.pop(key, None)
+        if meta is not None:
+            self._size -= meta["size"]
+
+    # Evict least recently used entries, by a fresh scan of the folder so entries from every
+    # worker count. Only one worker evicts at a time; the others just rescan.
+    async def _enforce_budget(self):
+        def _enforce():
+            os.makedirs(self.root, exist_ok=True)
+            lock_file = _try_lock(os.path.join(self.root, EVICT_LOCK))
+            try:
+                entries = self._scan()
+                size = sum(meta["size"] for meta in entries.values())
+                evicted = []
+                while lock_file is not None and entries and (size > self.max_bytes or len(entries) > self.max_entries):
+                    key, meta = entries.popitem(last=False)
+                    shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+                    try:
+                        os.remove(self._lock_path(key))
+                    except FileNotFoundError:
+                        pass
+                    size -= meta["size"]
+                    evicted.append(key)
+                return entries, evicted
+            finally:
+                if lock_file is not None:
+                    lock_file.close()
+
+        entries, evicted = await asyncio.to_thread(_enforce)
+        self._adopt(entries)
+        for key in evicted:
+            logger.info(f"Evicted cache entry {key}")
+
+    # Take the cross-process lock for key, polling without tying up a thread while another
+    # worker holds it. Returns the open lock file; closing it releases the lock.
+    async def _acquire(self, key: str):
+        lock_path = self._lock_path(key)
+        await asyncio.to_thread(os.makedirs, os.path.dirname(lock_path), exist_ok=True)
+        while True:
+            lock_file = await asyncio.to_thread(_try_lock, lock_path)
+            if lock_file is not None:
+                return lock_file
+            await asyncio.sleep(CACHE_LOCK_POLL)
+
+    # Serve key from the cache, or run download() once for all concurrent callers, in this
+    # worker or any other sharing the folder, and cache the result. download() must save
+    # into dest_dir and return the saved file records. Returns (saved_files, hit).
+    async def get_or_download(self, key: str, dest_dir: str, link: str, download):
+        cached = await self.fetch(key, dest_dir)
+        pending = self._inflight.get(key)
+        if cached is None and pending is not None:
+            # Only the completion matters here; if the other download failed we try our own
+            await asyncio.wait([pending])
+            cached = await self.fetch(key, dest_dir)
+        if cached is not None:
+            self.hits += 1
+            return cached, True
+
+        done = asyncio.get_running_loop().create_future()
+        self._inflight[key] = done
+        lock_file = None
+        try:
+            lock_file = await self._acquire(key)
+            # Another worker may have finished it while we waited for the lock
+            cached = await self.fetch(key, dest_dir)
+            if cached is not None:
+                self.hits += 1
+                return cached, True
+            self.misses += 1
+            saved_files = await download()
+            await self.store(key, dest_dir, saved_files, link)
+            return saved_files, False
+        finally:
+            if lock_file is not None:
+                await asyncio.to_thread(lock_file.close)
+            done.set_result(None)
+            self._inflight.pop(key, None)
+
+    def stats(self) -> dict:
+        return {"entries": len(self._entries), "bytes": self._size, "hits": self.hits, "misses": self.misses}
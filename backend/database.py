@@ -0,0 +1,49 @@
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+MONGODB_URI = os.getenv("MONGODB_URI", "mongodb://localhost:27017")
+MONGODB_DATABASE = os.getenv("MONGODB_DATABASE", "video_downloader")
+MONGODB_TIMEOUT_MS = int(os.getenv("MONGODB_TIMEOUT_MS", 10000))  # server selection timeout
+
+
+# MongoDB database whose client is created on first use instead of at import. Building a
+# client resolves mongodb+srv:// hosts over DNS and starts its monitor threads, so the
+# startup hook connects from a worker thread while the server already takes requests.
+# Collections handed out before then bind to the client once it exists.
+class LazyDatabase:
+    def __init__(self, uri: str = MONGODB_URI, name: str = MONGODB_DATABASE):
+        self.uri = uri
+        self.name = name
+        self._database = None
+        self._lock = threading.Lock()
+
+    def connect(self):
+        with self._lock:
+            if self._database is None:
+                from motor.motor_asyncio import AsyncIOMotorClient
+                client = AsyncIOMotorClient(self.uri, serverSelectionTimeoutMS=MONGODB_TIMEOUT_MS)
+                self._database = client[self.name]
+                logger.info(f"Created MongoDB client for database {self.name}")
+        return self._database
+
+    @property
+    def connected(self) -> bool:
+        return self._database is not None
+
+    def __getitem__(self, name: str):
+        return LazyCollection(self, name)
+
+    def __getattr__(self, attr):
+        return getattr(self.connect(), attr)
+
+
+class LazyCollection:
+    def __init__(self, database: LazyDatabase, name: str):
+        self.database = database
+        self.name = name
+
+    def __getattr__(self, attr):
+        return getattr(self.database.connect()[self.name], attr)
@@ -0,0 +1,229 @@
+from contextlib import contextmanager
+import os
+import logging
+import re
+import shutil
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+PROGRESS_INTERVAL = float(os.getenv("PROGRESS_INTERVAL", 0.5))  # seconds between progress events per download
+FRAGMENT_CONCURRENCY = int(os.getenv("FRAGMENT_CONCURRENCY", 4))  # fragments of a DASH/HLS stream fetched at once
+HTTP_CHUNK_SIZE = int(os.getenv("HTTP_CHUNK_SIZE", 10 * 1024 * 1024))  # range request size for plain HTTP downloads
+RANGE_CONNECTIONS = int(os.getenv("RANGE_CONNECTIONS", 4))  # parallel ranges per file when aria2c is installed
+
+
+_ytdlp_lock = threading.Lock()
+
+
+# yt-dlp is imported on first use, so the API process starts without loading its
+# extractors. The import is serialized: a thread importing it while another is still
+# halfway through can find the package partly initialized.
+def load_ytdlp():
+    with _ytdlp_lock:
+        import yt_dlp
+        import yt_dlp.extractor
+    return yt_dlp
+
+
+def sanitize_filename(filename: str) -> str:
+    return re.sub(r'[^\w\s-]', '', filename).replace(' ', '_')
+
+
+# yt-dlp writes its cookie jar back to the cookie file when it closes, so concurrent
+# downloads sharing one file can corrupt it for each other. Every run gets a private copy;
+# yields its path, or None when there is no cookie file.
+@contextmanager
+def private_cookiefile(cookiefile: str):
+    if not cookiefile or not os.path.exists(cookiefile):
+        yield None
+        return
+    fd, path = tempfile.mkstemp(suffix=".cookies.txt")
+    os.close(fd)
+    try:
+        shutil.copyfile(cookiefile, path)
+        yield path
+    finally:
+        os.remove(path)
+
+
+# Blocking yt-dlp download, run on a scheduler worker thread or process. ydl_opts must
+# stay picklable for the process pool, so hooks and the logger are attached here.
+# Throttled byte-level progress is put on the events queue for the given channels, and
+# per-stage timings go on it as "stage" events with no channels. A cached info dict from
+# run_probe skips page and format extraction.
+def run_download(link: str, ydl_opts: dict, user_downloads_dir: str, events=None, channels=(),
+                 total: int = 1, current: int = 1, info: dict = None) -> list:
+    yt_dlp = load_ytdlp()
+
+    os.makedirs(user_downloads_dir, exist_ok=True)
+    saved_files = []
+    last_emit = [0.0]
+    started = {}  # filename or postprocessor -> perf_counter at its start
+    video_id = [None]  # id of the video being downloaded, for titles that sanitize to nothing
+
+    def emit_stage(stage, seconds):
+        if events is not None:
+            events.put(((), {"type": "stage", "stage": stage, "seconds": seconds}))
+
+    def emit_progress(d):
+        now = time.monotonic()
+        if d.get('status') == 'downloading' and now - last_emit[0] < PROGRESS_INTERVAL:
+            return
+        last_emit[0] = now
+        events.put((tuple(channels), {
+            "type": "progress",
+            "link": link,
+            "current": current,
+            "total": total,
+            "status": d.get('status'),
+            "downloaded_bytes": d.get('downloaded_bytes'),
+            "total_bytes": d.get('total_bytes') or d.get('total_bytes_estimate'),
+            "speed": d.get('speed'),
+            "eta": d.get('eta'),
+        }))
+
+    def progress_hook(d):
+        filename = d.get('filename')
+        video_id[0] = (d.get('info_dict') or {}).get('id') or video_id[0]
+        if d.get('status') == 'downloading':
+            started.setdefault(filename, time.perf_counter())
+        elif d.get('status') == 'finished' and filename in started:
+            emit_stage("transfer", time.perf_counter() - started.pop(filename))
+        if events is not None:
+            try:
+                emit_progress(d)
+            except Exception as e:
+                logger.warning(f"Failed to publish progress for {link}: {str(e)}")
+
+    def postprocessor_hook(d):
+        name = d.get('postprocessor')
+        video_id[0] = (d.get('info_dict') or {}).get('id') or video_id[0]
+        if d.get('status') == 'started':
+            started[name] = time.perf_counter()
+        elif d.get('status') == 'finished' and name in started:
+            emit_stage("merge" if name == "Merger" else "postprocess", time.perf_counter() - started.pop(name))
+
+    # Runs once per link on the final file, after any merge or remux, so intermediate
+    # stream files are never touched and the real extension is kept
+    def rename_final(final_filename):
+        rename_started = time.perf_counter()
+        if final_filename and os.path.exists(final_filename):
+            base, ext = os.path.splitext(final_filename)
+            # A title of only emoji or punctuation would leave a hidden ".mp4"
+            sanitized_base = sanitize_filename(os.path.basename(base)) or sanitize_filename(video_id[0] or "") or "video"
+            new_filename = f"{sanitized_base}{ext}"
+            new_filepath = os.path.join(user_downloads_dir, new_filename)
+            try:
+                os.rename(final_filename, new_filepath)
+                logger.info(f"Renamed file to: {new_filepath}")
+                saved_files.append({"filename": new_filename, "size": os.path.getsize(new_filepath)})
+            except Exception as e:
+                logger.error(f"Failed to rename file {final_filename} to {new_filepath}: {str(e)}")
+        emit_stage("rename", time.perf_counter() - rename_started)
+
+    ydl_opts = dict(ydl_opts)
+    ydl_opts["outtmpl"] = f"{user_downloads_dir}/%(title)s.%(ext)s"
+    ydl_opts["progress_hooks"] = [progress_hook]
+    ydl_opts["postprocessor_hooks"] = [postprocessor_hook]
+    ydl_opts["post_hooks"] = [rename_final]
+    ydl_opts["logger"] = logging.getLogger("yt_dlp")
+
+    def extract(ydl):
+        # Resolve the page without processing it, so extraction is timed apart from the
+        # format selection and transfer done by process_ie_result
+        extract_started = time.perf_counter()
+        result = ydl.extract_info(link, download=False, process=False)
+        emit_stage("metadata", time.perf_counter() - extract_started)
+        return result
+
+    with private_cookiefile(ydl_opts.pop("cookiefile", None)) as cookiefile, \
+            yt_dlp.YoutubeDL({**ydl_opts, "cookiefile": cookiefile}) as ydl:
+        if info is None:
+            ydl.process_ie_result(extract(ydl), download=True)
+        else:
+            try:
+                ydl.process_ie_result(info, download=True)
+            except (yt_dlp.utils.DownloadError, yt_dlp.utils.ExtractorError) as e:
+                # Format URLs in the cached info may have expired
+                logger.warning(f"Cached info failed for {link}, extracting again: {str(e)}")
+                ydl.process_ie_result(extract(ydl), download=True)
+    if not saved_files:
+        raise Exception("No files were created after download")
+    return saved_files
+
+
+# JSON-safe copy of a probed info dict. yt-dlp counts the selected formats of a split
+# video+audio download among its private keys; they are kept, since pass-through
+# streaming hands them to ffmpeg.
+def probe_result(ydl, info: dict) -> dict:
+    result = ydl.sanitize_info(info, remove_private_keys=True)
+    if info.get("requested_formats"):
+        # sanitize_info stamps every dict it is given as a video; formats drop that again
+        result["requested_formats"] = [
+            {k: v for k, v in ydl.sanitize_info(dict(fmt), remove_private_keys=True).items() if k not in ("epoch", "_type", "_version")}
+            for fmt in info["requested_formats"]
+        ]
+    return result
+
+
+# Resolve a link's page and formats without downloading, for the pre-flight stage
+def run_probe(link: str, ydl_opts: dict) -> dict:
+    yt_dlp = load_ytdlp()
+
+    ydl_opts = dict(ydl_opts)
+    ydl_opts["logger"] = logging.getLogger("yt_dlp")
+    with private_cookiefile(ydl_opts.pop("cookiefile", None)) as cookiefile, \
+            yt_dlp.YoutubeDL({**ydl_opts, "cookiefile": cookiefile}) as ydl:
+        info = ydl.extract_info(link, download=False)
+        return probe_result(ydl, info)
+
+
+# Transfer settings for yt-dlp. Fragmented streams have their fragments fetched
+# concurrently; single files are fetched in ranges, in parallel through aria2c when it is
+# installed and RANGE_CONNECTIONS allows, sequentially by yt-dlp otherwise.
+def transfer_options() -> dict:
+    options = {"concurrent_fragment_downloads": FRAGMENT_CONCURRENCY, "http_chunk_size": HTTP_CHUNK_SIZE}
+    if RANGE_CONNECTIONS > 1 and shutil.which("aria2c"):
+        options["external_downloader"] = {"http": "aria2c"}
+        options["external_downloader_args"] = {"aria2c": [
+            "-x", str(RANGE_CONNECTIONS), "-s", str(RANGE_CONNECTIONS), "-k", "1M", "--console-log-level=warn",
+        ]}
+    return options
+
+
+# Resolve one page of a playlist, channel or profile without resolving its videos. Returns
+# (links, collections, more, info): video links on entries start..start+count-1, nested
+# collections (e.g. a channel's tabs), whether more entries may follow, and for a link that
+# turned out to be a single video its probed info instead.
+def run_expand_page(link: str, ydl_opts: dict, start: int, count: int) -> tuple:
+    yt_dlp = load_ytdlp()
+
+    ydl_opts = dict(ydl_opts)
+    ydl_opts.update({
+        "logger": logging.getLogger("yt_dlp"),
+        "noplaylist": False,
+        "extract_flat": "in_playlist",
+        "lazy_playlist": True,
+        "playlist_items": f"{start + 1}:{start + count}",
+    })
+    with private_cookiefile(ydl_opts.pop("cookiefile", None)) as cookiefile, \
+            yt_dlp.YoutubeDL({**ydl_opts, "cookiefile": cookiefile}) as ydl:
+        info = ydl.extract_info(link, download=False)
+        if info.get("_type") not in ("playlist", "multi_video"):
+            if start:
+                return [], [], False, None
+            return [link], [], False, probe_result(ydl, info)
+        entries = [entry for entry in info.get("entries") or [] if entry]
+    links, collections = [], []
+    for entry in entries:
+        url = entry.get("webpage_url") or entry.get("url")
+        if not url or not url.startswith(("http://", "https://")):
+            continue
+        if entry.get("_type") == "playlist" or (entry.get("ie_key") or "").endswith("Tab"):
+            collections.append(url)
+        else:
+            links.append(url)
+    return links, collections, len(entries) >= count, None
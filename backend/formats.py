@@ -0,0 +1,31 @@
+# Format selection per platform. Every profile tries a pre-muxed (progressive) format
+# first, which needs no ffmpeg at all; only when a platform serves split streams do we fall
+# back to video+audio, preferring mp4/m4a pairs so the merge is a plain stream copy.
+FORMAT_PROFILES = {
+    "instagram": "best[height<=720][vcodec!=none][acodec!=none]/bestvideo[height<=720][ext=mp4]+bestaudio[ext=m4a]/bestvideo[height<=720]+bestaudio/best",
+    "youtube": "best[height<=720][ext=mp4][vcodec!=none][acodec!=none]/bestvideo[height<=720][ext=mp4]+bestaudio[ext=m4a]/best[height<=720]/best",
+    "x": "best[height<=720][ext=mp4]/best[height<=720]/bestvideo[height<=720]+bestaudio/best",
+    "unknown": "best[height<=720]/bestvideo[height<=720]+bestaudio/best",
+}
+# Among the formats a selector accepts, prefer mp4/m4a (no remux needed) and plain HTTPS
+# over fragmented HLS/DASH
+FORMAT_SORT = ["res:720", "ext:mp4:m4a", "proto"]
+AUDIO_FORMAT = "bestaudio[ext=m4a]/bestaudio/best"
+
+MODES = ("video", "audio")
+
+
+def format_options(platform: str, mode: str = "video") -> dict:
+    if mode == "audio":
+        return {
+            "format": AUDIO_FORMAT,
+            # "best" keeps the source codec: the audio stream is copied out, never re-encoded
+            "postprocessors": [{"key": "FFmpegExtractAudio", "preferredcodec": "best"}],
+        }
+    return {
+        "format": FORMAT_PROFILES.get(platform, FORMAT_PROFILES["unknown"]),
+        "format_sort": FORMAT_SORT,
+        "merge_output_format": "mp4",
+        # Non-mp4 downloads are remuxed with a stream copy; mp4 files are left alone
+        "postprocessors": [{"key": "FFmpegVideoRemuxer", "preferedformat": "mp4"}],
+    }
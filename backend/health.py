@@ -0,0 +1,96 @@
+import asyncio
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+FFMPEG_BINARY = os.getenv("FFMPEG_BINARY", "ffmpeg")
+PROBE_TIMEOUT = float(os.getenv("PROBE_TIMEOUT", 5))  # seconds a capability probe may take
+MONGO_RECHECK = float(os.getenv("MONGO_RECHECK", 5))  # seconds a MongoDB ping result is reused by /readyz
+MONGO_RETRY = float(os.getenv("MONGO_RETRY", 2))  # seconds between startup pings while MongoDB is unreachable
+READY_REQUIRES_FFMPEG = os.getenv("READY_REQUIRES_FFMPEG", "true").lower() in ("1", "true", "yes")
+
+
+async def probe_ffmpeg(binary: str = FFMPEG_BINARY) -> dict:
+    try:
+        process = await asyncio.create_subprocess_exec(
+            binary, "-version", stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.DEVNULL,
+        )
+    except FileNotFoundError:
+        return {"ok": False, "error": f"{binary} is not found in PATH"}
+    except OSError as e:
+        return {"ok": False, "error": f"{binary} could not be run: {str(e)}"}
+    try:
+        stdout, _ = await asyncio.wait_for(process.communicate(), PROBE_TIMEOUT)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+        return {"ok": False, "error": f"{binary} -version timed out"}
+    if process.returncode != 0:
+        return {"ok": False, "error": f"{binary} -version exited with status {process.returncode}"}
+    lines = stdout.decode(errors="replace").splitlines()
+    return {"ok": True, "version": lines[0] if lines else None}
+
+
+async def probe_mongo(db) -> dict:
+    started = time.perf_counter()
+    try:
+        await asyncio.wait_for(db.command("ping"), PROBE_TIMEOUT)
+    except Exception as e:
+        return {"ok": False, "error": str(e) or type(e).__name__}
+    return {"ok": True, "latency_ms": round((time.perf_counter() - started) * 1000, 1)}
+
+
+# What this replica can do, as found by the capability probes. ffmpeg is probed once at
+# startup; MongoDB is pinged again by /readyz when the last result is older than
+# MONGO_RECHECK, so a replica that loses its database drops out of rotation.
+class Readiness:
+    def __init__(self, requires_ffmpeg: bool = READY_REQUIRES_FFMPEG):
+        self.requires_ffmpeg = requires_ffmpeg
+        self.checks = {}  # name -> probe result
+        self._checked_at = {}  # name -> monotonic time of the result
+
+    def _set(self, name: str, result: dict):
+        if result["ok"] != self.checks.get(name, {}).get("ok"):
+            log = logger.info if result["ok"] else logger.error
+            log(f"{name} is {'available' if result['ok'] else 'unavailable'}: {result.get('version') or result.get('error') or 'ok'}")
+        self.checks[name] = result
+        self._checked_at[name] = time.monotonic()
+
+    async def check_ffmpeg(self):
+        self._set("ffmpeg", await probe_ffmpeg())
+
+    async def check_mongo(self, db):
+        self._set("mongo", await probe_mongo(db))
+
+    # Ping MongoDB until it answers; the startup hook runs this in the background. connect,
+    # if given, creates the client and is retried with the pings, since resolving a
+    # mongodb+srv:// host fails for as long as DNS does.
+    async def wait_for_mongo(self, db, connect=None):
+        while True:
+            try:
+                if connect is not None:
+                    await asyncio.to_thread(connect)
+            except Exception as e:
+                self._set("mongo", {"ok": False, "error": str(e) or type(e).__name__})
+            else:
+                await self.check_mongo(db)
+            if self.checks["mongo"]["ok"]:
+                return
+            await asyncio.sleep(MONGO_RETRY)
+
+    @property
+    def ready(self) -> bool:
+        required = ["mongo", "ffmpeg"] if self.requires_ffmpeg else ["mongo"]
+        return all(self.checks.get(name, {}).get("ok") for name in required)
+
+    async def report(self, db) -> dict:
+        if "mongo" in self.checks and time.monotonic() - self._checked_at["mongo"] > MONGO_RECHECK:
+            await self.check_mongo(db)
+        pending = {"ok": False, "error": "not checked yet"}
+        return {
+            "status": "ready" if self.ready else "not ready",
+            "checks": {name: self.checks.get(name, pending) for name in ("mongo", "ffmpeg")},
+        }
@@ -0,0 +1,68 @@
+import csv
+import io
+import logging
+import os
+from urls import normalize_url
+
+logger = logging.getLogger(__name__)
+
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", 500))
+LINK_COLUMN = "video_link"
+SUPPORTED_EXTENSIONS = (".xlsx", ".csv")
+
+
+def _xlsx_rows(fileobj):
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(fileobj, read_only=True, data_only=True)
+    try:
+        yield from workbook.active.iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+
+def _csv_rows(fileobj):
+    text = io.TextIOWrapper(fileobj, encoding="utf-8-sig", newline="")
+    try:
+        yield from csv.reader(text)
+    finally:
+        text.detach()  # leave the upload's file open for its owner
+
+
+# Parse the video_link column of an uploaded sheet lazily, row by row, and yield lists of
+# up to batch_size deduplicated links. Links are compared by their normalized form but
+# kept as uploaded. stats is filled in as rows are read.
+def iter_link_batches(fileobj, filename: str, stats: dict, batch_size: int = INGEST_BATCH_SIZE):
+    rows = _csv_rows(fileobj) if filename.lower().endswith(".csv") else _xlsx_rows(fileobj)
+    try:
+        header = next(rows, None)
+        columns = [str(cell).strip().lower() if cell is not None else "" for cell in header or ()]
+        if LINK_COLUMN not in columns:
+            raise ValueError("Excel file must contain a 'video_link' column")
+        column = columns.index(LINK_COLUMN)
+
+        seen = set()
+        batch = []
+        stats.update(count=0, duplicates=0, skipped=0)
+        for row in rows:
+            cell = row[column] if column < len(row) else None
+            if cell is None or not str(cell).strip():
+                continue
+            link = str(cell).strip()
+            if not link.lower().startswith(("http://", "https://")):
+                stats["skipped"] += 1
+                continue
+            key = normalize_url(link)
+            if key in seen:
+                stats["duplicates"] += 1
+                continue
+            seen.add(key)
+            batch.append(link)
+            stats["count"] += 1
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+    finally:
+        rows.close()
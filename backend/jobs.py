@@ -0,0 +1,418 @@
+from datetime import datetime, timedelta, timezone
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from progress import session_channel, job_channel
+from metrics import STAGE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+QUEUE_CONCURRENCY = int(os.getenv("QUEUE_CONCURRENCY", 16))  # links one worker process runs at once
+LEASE_SECONDS = int(os.getenv("LEASE_SECONDS", 60))  # a link whose lease lapses is claimed by another worker
+QUEUE_POLL_INTERVAL = float(os.getenv("QUEUE_POLL_INTERVAL", 1.0))
+MAX_ATTEMPTS = int(os.getenv("MAX_ATTEMPTS", 3))  # claims per link before it is failed for good
+JOB_WAIT_INTERVAL = float(os.getenv("JOB_WAIT_INTERVAL", 0.5))
+EXPAND_PAGE_SIZE = int(os.getenv("EXPAND_PAGE_SIZE", 50))  # entries resolved per playlist page
+MAX_EXPANDED_LINKS = int(os.getenv("MAX_EXPANDED_LINKS", 5000))  # links one expanded job may grow to
+EXPAND_BACKLOG = int(os.getenv("EXPAND_BACKLOG", 2 * EXPAND_PAGE_SIZE))  # queued links a job may have before its next page
+EXPAND_DEFER = float(os.getenv("EXPAND_DEFER", 5))  # seconds a page waits while the job is over its backlog
+
+
+def _now():
+    return datetime.now(timezone.utc)
+
+
+# Tracks download batches as documents in the MongoDB jobs collection. Every link carries
+# its own state, and the per-state counts are kept alongside so status polls can skip the
+# link list entirely.
+#
+# The work itself goes through a queue collection holding one document per link. Every
+# worker process runs the same claim loop: it leases queued links, renews the leases with a
+# heartbeat while it downloads, and a link whose lease lapses (its worker died) is claimed
+# again by whichever worker gets there first. download(link, session_id, total, current,
+# job_id, **options) performs one link and returns the same result dict as
+# download_single_video.
+#
+# An expanded job starts from playlist, channel or profile links instead, queued as "expand"
+# items. expand(link, session_id, start, count, **options) resolves one page of entries and
+# returns (links, collections, more); the page's links are appended to the job, and the
+# next page and any nested collections are queued behind them. A page waits while the job
+# already has EXPAND_BACKLOG links queued, so a huge channel is never listed up front.
+#
+# A worker holds at most max_per_session items of one session at a time, matching the
+# scheduler's per-session cap; sessions at the cap are skipped when claiming, so one big
+# batch can't take every slot while its links wait on the scheduler.
+class JobManager:
+    def __init__(self, collection, queue, download, broker=None, concurrency: int = QUEUE_CONCURRENCY, expand=None, max_per_session: int = None):
+        self.collection = collection
+        self.queue = queue
+        self.download = download
+        self.expand = expand
+        self.broker = broker
+        self.concurrency = concurrency
+        self.max_per_session = max_per_session or concurrency
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._inflight = {}  # queue item _id -> asyncio.Task running it in this process
+        self._session_inflight = {}  # session_id -> items of that session running in this process
+        self._wakeup = asyncio.Event()
+        self._loops = []
+
+    async def ensure_indexes(self):
+        await self.queue.create_index([("status", 1), ("created_at", 1)])
+        await self.queue.create_index([("status", 1), ("available_at", 1)])
+        await self.queue.create_index([("status", 1), ("lease_until", 1)])
+
+    async def create(self, session_id: str, links: list, options: dict = None, expand: bool = False) -> dict:
+        if expand and self.expand is None:
+            raise ValueError("This job manager can't expand links")
+        now = _now()
+        downloads = [] if expand else links
+        job = {
+            "_id": str(uuid.uuid4()),
+            "session_id": session_id,
+            "status": "queued",
+            "options": options or {},
+            "total": len(downloads),
+            "counts": {"queued": len(downloads), "running": 0, "done": 0, "failed": 0},
+            "links": [{"link": link, "status": "queued", "error": None} for link in downloads],
+            "expand": expand,
+            "pending_pages": len(links) if expand else 0,
+            "pages": {},
+            "created_at": now,
+            "updated_at": now,
+        }
+        await self.collection.insert_one(job)
+        if links:
+            if expand:
+                items = [self._page_item(job, str(source), link, 0, now) for source, link in enumerate(links)]
+            else:
+                items = [self._link_item(job, index, len(links), link, now) for index, link in enumerate(links)]
+            await self.queue.insert_many(items)
+        else:
+            await self.collection.update_one({"_id": job["_id"]}, {"$set": {"status": "done", "finished_at": now}})
+            job["status"] = "done"
+        logger.info(f"Created job {job['_id']} with {len(links)} links for session {session_id}")
+        self._wakeup.set()
+        return job
+
+    @staticmethod
+    def _link_item(job: dict, index: int, total: int, link: str, now) -> dict:
+        return {
+            "_id": f"{job['_id']}:{index}",
+            "kind": "download",
+            "job_id": job["_id"],
+            "session_id": job["session_id"],
+            "index": index,
+            "total": total,
+            "link": link,
+            "options": job["options"],
+            "status": "queued",
+            "attempts": 0,
+            "worker": None,
+            "lease_until": None,
+            "available_at": now,
+            "created_at": now,
+        }
+
+    # source names the collection within the job: its position among the submitted links,
+    # with "/<n>" appended for each level of nesting
+    @staticmethod
+    def _page_item(job: dict, source: str, link: str, start: int, now) -> dict:
+        return {
+            "_id": f"{job['_id']}:page:{source}:{start}",
+            "kind": "expand",
+            "job_id": job["_id"],
+            "session_id": job["session_id"],
+            "index": -1,
+            "source": source,
+            "start": start,
+            "link": link,
+            "options": job["options"],
+            "status": "queued",
+            "attempts": 0,
+            "worker": None,
+            "lease_until": None,
+            "available_at": now,
+            "created_at": now,
+        }
+
+    async def get(self, job_id: str, session_id: str, include_links: bool = True):
+        projection = None if include_links else {"links": 0}
+        return await self.collection.find_one({"_id": job_id, "session_id": session_id}, projection)
+
+    # Wait for a job to finish, on whichever worker runs it, and return its final document
+    async def wait(self, job_id: str):
+        while True:
+            job = await self.collection.find_one({"_id": job_id}, {"links": 0})
+            if job is None or job["status"] in ("done", "failed"):
+                return await self.collection.find_one({"_id": job_id})
+            await asyncio.sleep(JOB_WAIT_INTERVAL)
+
+    # Links this worker is running right now
+    @property
+    def active(self) -> int:
+        return len(self._inflight)
+
+    def start(self):
+        if not self._loops:
+            self._loops = [asyncio.create_task(self._claim_loop()), asyncio.create_task(self._heartbeat_loop())]
+            logger.info(f"Queue worker {self.worker_id} started with concurrency {self.concurrency}")
+
+    # Stop claiming and hand the links this worker holds back to the queue right away
+    # instead of leaving them until their leases lapse
+    async def shutdown(self):
+        for task in self._loops:
+            task.cancel()
+        self._loops = []
+        held = list(self._inflight)
+        for task in list(self._inflight.values()):
+            task.cancel()
+        self._inflight.clear()
+        if held:
+            try:
+                await self.queue.update_many(
+                    {"_id": {"$in": held}, "worker": self.worker_id, "status": "running"},
+                    {"$set": {"lease_until": _now()}},
+                )
+                logger.info(f"Released {len(held)} leased links back to the queue")
+            except Exception as e:
+                logger.error(f"Failed to release {len(held)} leased links: {str(e)}")
+
+    async def _claim_loop(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                while len(self._inflight) < self.concurrency:
+                    item = await self._claim()
+                    if item is None:
+                        break
+                    task = asyncio.create_task(self._process(item))
+                    self._inflight[item["_id"]] = task
+                    self._session_inflight[item["session_id"]] = self._session_inflight.get(item["session_id"], 0) + 1
+                    task.add_done_callback(lambda _, item_id=item["_id"], session_id=item["session_id"]: self._on_done(item_id, session_id))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Queue worker {self.worker_id} failed to claim work: {str(e)}")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=QUEUE_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+
+    def _on_done(self, item_id: str, session_id: str):
+        self._inflight.pop(item_id, None)
+        remaining = self._session_inflight.get(session_id, 0) - 1
+        if remaining > 0:
+            self._session_inflight[session_id] = remaining
+        else:
+            self._session_inflight.pop(session_id, None)
+        self._wakeup.set()
+
+    # Lease one queued link that is due, or one whose lease has lapsed, of a session this
+    # worker isn't already running max_per_session items for. The item is returned as it
+    # was before the claim, so the caller can tell a fresh link from a takeover.
+    async def _claim(self):
+        now = _now()
+        saturated = [session_id for session_id, count in self._session_inflight.items() if count >= self.max_per_session]
+        return await self.queue.find_one_and_update(
+            {"session_id": {"$nin": saturated}, "$or": [
+                {"status": "queued", "available_at": {"$not": {"$gt": now}}},
+                {"status": "running", "lease_until": {"$lt": now}},
+            ]},
+            {
+                "$set": {"status": "running", "worker": self.worker_id, "lease_until": now + timedelta(seconds=LEASE_SECONDS)},
+                "$inc": {"attempts": 1},
+            },
+            sort=[("created_at", 1), ("index", 1)],
+            return_document=ReturnDocument.BEFORE,
+        )
+
+    async def _heartbeat_loop(self):
+        while True:
+            await asyncio.sleep(LEASE_SECONDS / 3)
+            if not self._inflight:
+                continue
+            try:
+                await self.queue.update_many(
+                    {"_id": {"$in": list(self._inflight)}, "worker": self.worker_id, "status": "running"},
+                    {"$set": {"lease_until": _now() + timedelta(seconds=LEASE_SECONDS)}},
+                )
+            except Exception as e:
+                logger.error(f"Queue worker {self.worker_id} failed to renew leases: {str(e)}")
+
+    async def _process(self, item: dict):
+        if item.get("kind") == "expand":
+            await self._expand(item)
+            return
+        job_id, index = item["job_id"], item["index"]
+        if item["status"] == "queued":
+            await self._set_link_state(job_id, index, "queued", "running")
+            await self.collection.update_one({"_id": job_id, "status": "queued"}, {"$set": {"status": "running"}})
+        else:
+            logger.warning(f"Taking over link {index} of job {job_id} from worker {item['worker']}")
+
+        if item["attempts"] >= MAX_ATTEMPTS:
+            result = {"link": item["link"], "status": "failed", "error": f"Gave up after {MAX_ATTEMPTS} attempts"}
+        else:
+            try:
+                result = await self.download(item["link"], item["session_id"], item["total"], index + 1, job_id, **item["options"])
+            except Exception as e:
+                logger.error(f"Link {index} of job {job_id} failed: {str(e)}")
+                result = {"link": item["link"], "status": "failed", "error": str(e)}
+
+        status = "done" if result.get("status") == "success" else "failed"
+        finished = await self.queue.update_one(
+            {"_id": item["_id"], "worker": self.worker_id, "status": "running"},
+            {"$set": {"status": status, "error": result.get("error"), "lease_until": None}},
+        )
+        if finished.modified_count == 0:
+            # The lease lapsed and another worker owns the link now; its result wins
+            logger.warning(f"Lost the lease on link {index} of job {job_id}, discarding result")
+            return
+        await self._set_link_state(job_id, index, "running", status, result.get("error"))
+        await self._finish_job(item)
+
+    # One page of an expanded job. The job document is updated first, in a single write
+    # guarded by the page's entry in "pages", which also records what the page found; the
+    # queue items for its links, next page and nested collections are then inserted under
+    # fixed ids. A worker that takes the page over after a crash in between skips the
+    # resolving and repeats only the inserts, whose duplicates are ignored.
+    async def _expand(self, item: dict):
+        job_id, page = item["job_id"], f"{item['source']}:{item['start']}"
+        job = await self.collection.find_one({"_id": job_id}, {"counts": 1, "total": 1, f"pages.{page}": 1})
+        if job is None:
+            await self._close_item(item, "failed", "Job no longer exists")
+            return
+        if page not in job.get("pages", {}):
+            if item["attempts"] < MAX_ATTEMPTS and job["counts"]["queued"] >= EXPAND_BACKLOG:
+                await self._defer(item)
+                return
+            await self.collection.update_one({"_id": job_id, "status": "queued"}, {"$set": {"status": "running"}})
+            await self._resolve_page(item, page, MAX_EXPANDED_LINKS - job["total"])
+        job = await self.collection.find_one({"_id": job_id}, {"links.page": 1, "links.link": 1, "total": 1, f"pages.{page}": 1})
+        found = job["pages"][page]
+
+        owner = {"_id": job_id, "session_id": item["session_id"], "options": item["options"]}
+        now = _now()
+        items = [
+            self._link_item(owner, index, job["total"], entry["link"], now)
+            for index, entry in enumerate(job["links"]) if entry.get("page") == page
+        ]
+        for number, link in enumerate(found["collections"]):
+            items.append(self._page_item(owner, f"{item['source']}/{item['start'] + number}", link, 0, now))
+        if found["next"] is not None:
+            items.append(self._page_item(owner, item["source"], item["link"], found["next"], now))
+        if items:
+            try:
+                await self.queue.insert_many(items, ordered=False)
+            except BulkWriteError as e:
+                if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+                    raise
+        await self._close_item(item, "done")
+        self._wakeup.set()
+        await self._finish_job(item)
+
+    async def _resolve_page(self, item: dict, page: str, room: int):
+        count = min(EXPAND_PAGE_SIZE, room)
+        links, collections, more, error = [], [], False, None
+        if item["attempts"] >= MAX_ATTEMPTS:
+            error = f"Gave up after {MAX_ATTEMPTS} attempts"
+        elif count <= 0:
+            logger.warning(f"Job {item['job_id']} reached {MAX_EXPANDED_LINKS} links, not expanding {item['link']} further")
+        else:
+            try:
+                links, collections, more = await self.expand(item["link"], item["session_id"], item["start"], count, **item["options"])
+            except Exception as e:
+                logger.error(f"Expanding {item['link']} from entry {item['start']} for job {item['job_id']} failed: {str(e)}")
+                error = str(e)
+        if error:
+            entries = [{"link": item["link"], "status": "failed", "error": error}]
+        else:
+            entries = [{"link": link, "status": "queued", "error": None, "page": page} for link in dict.fromkeys(links)]
+        found = {"next": item["start"] + count if more and not error else None, "collections": [] if error else collections}
+        pages = len(found["collections"]) + (found["next"] is not None) - 1
+        with STAGE_SECONDS.time("mongo_write"):
+            await self.collection.update_one(
+                {"_id": item["job_id"], f"pages.{page}": {"$exists": False}},
+                {
+                    "$push": {"links": {"$each": entries}},
+                    "$inc": {
+                        "total": len(entries),
+                        "counts.queued": 0 if error else len(entries),
+                        "counts.failed": 1 if error else 0,
+                        "pending_pages": pages,
+                    },
+                    "$set": {f"pages.{page}": found, "updated_at": _now()},
+                },
+            )
+        logger.info(f"Expanded {item['link']} from entry {item['start']} into {len(entries)} links for job {item['job_id']}")
+
+    # Hand a page back to the queue for later without counting the claim as an attempt
+    async def _defer(self, item: dict):
+        await self.queue.update_one(
+            {"_id": item["_id"], "worker": self.worker_id, "status": "running"},
+            {
+                "$set": {"status": "queued", "worker": None, "lease_until": None,
+                         "available_at": _now() + timedelta(seconds=EXPAND_DEFER)},
+                "$inc": {"attempts": -1},
+            },
+        )
+
+    async def _close_item(self, item: dict, status: str, error: str = None):
+        await self.queue.update_one(
+            {"_id": item["_id"], "worker": self.worker_id, "status": "running"},
+            {"$set": {"status": status, "error": error, "lease_until": None}},
+        )
+
+    # Whichever worker finishes the last link closes the job; an expanded job stays open
+    # while any of its pages are still to be resolved
+    async def _finish_job(self, item: dict):
+        now = _now()
+        closed = await self.collection.update_one(
+            {
+                "_id": item["job_id"],
+                "counts.queued": 0,
+                "counts.running": 0,
+                "pending_pages": {"$not": {"$gt": 0}},
+                "status": {"$nin": ["done", "failed"]},
+            },
+            {"$set": {"status": "done", "finished_at": now, "updated_at": now}},
+        )
+        if closed.modified_count:
+            self._publish(item, {"type": "job", "job_id": item["job_id"], "status": "done"})
+            logger.info(f"Job {item['job_id']} finished for session {item['session_id']}")
+
+    def _publish(self, item: dict, event: dict):
+        if self.broker is not None:
+            self.broker.publish([session_channel(item["session_id"]), job_channel(item["job_id"])], event)
+
+    async def _set_link_state(self, job_id: str, index: int, old: str, new: str, error: str = None):
+        with STAGE_SECONDS.time("mongo_write"):
+            await self.collection.update_one(
+                {"_id": job_id},
+                {
+                    "$set": {f"links.{index}.status": new, f"links.{index}.error": error, "updated_at": _now()},
+                    "$inc": {f"counts.{old}": -1, f"counts.{new}": 1},
+                },
+            )
+
+
+# Shape a job document for API responses
+def job_summary(job: dict) -> dict:
+    summary = {
+        "job_id": job["_id"],
+        "status": job["status"],
+        "total": job["total"],
+        "counts": job["counts"],
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"],
+    }
+    if job.get("expand"):
+        summary["pending_pages"] = job.get("pending_pages", 0)
+    if "links" in job:
+        summary["links"] = job["links"]
+    return summary
@@ -0,0 +1,45 @@
+from logging.handlers import QueueHandler, QueueListener
+import atexit
+import logging
+import os
+import queue
+import random
+
+LOG_FILE = os.getenv("LOG_FILE", "app.log")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", 1.0))  # share of INFO/DEBUG records kept; warnings always are
+YTDLP_LOG_LEVEL = os.getenv("YTDLP_LOG_LEVEL", "WARNING").upper()
+LOG_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
+
+
+# Keeps every WARNING and above, and a random sample of everything below
+class SamplingFilter(logging.Filter):
+    def __init__(self, rate: float):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno >= logging.WARNING or self.rate >= 1 or random.random() < self.rate
+
+
+# Route all logging through an in-memory queue so request handlers and workers never wait
+# on file I/O; a listener thread does the writing. yt-dlp's own chatter goes to the
+# "yt_dlp" logger, which is quiet unless YTDLP_LOG_LEVEL says otherwise.
+def setup_logging(filename: str = LOG_FILE, level: str = LOG_LEVEL, sample_rate: float = LOG_SAMPLE_RATE) -> QueueListener:
+    file_handler = logging.FileHandler(filename)
+    file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    records = queue.SimpleQueue()
+    queue_handler = QueueHandler(records)
+    queue_handler.addFilter(SamplingFilter(sample_rate))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+    logging.getLogger("yt_dlp").setLevel(YTDLP_LOG_LEVEL)
+
+    listener = QueueListener(records, file_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
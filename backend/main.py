@@ -1,44 +1,56 @@
-from fastapi import FastAPI, UploadFile, HTTPException, WebSocket, Depends, Query, Request, Response
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi import APIRouter, FastAPI, UploadFile, HTTPException, WebSocket, WebSocketDisconnect, Depends, Query, Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, PlainTextResponse, RedirectResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from pymongo.errors import DuplicateKeyError
+from starlette.concurrency import iterate_in_threadpool
 from starlette.middleware.base import BaseHTTPMiddleware
-import pandas as pd
-import yt_dlp
 import os
-import subprocess
+import shutil
 from typing import List
-from motor.motor_asyncio import AsyncIOMotorClient
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
+from datetime import datetime, timezone
 import asyncio
+import functools
 import logging
 import uuid
-import re
+from downloader import run_download, run_probe, run_expand_page, transfer_options, load_ytdlp
+from jobs import JobManager, job_summary
+from scheduler import DownloadScheduler
+from progress import ProgressBroker, session_channel, job_channel
+from cache import DownloadCache, cache_key
+from urls import video_identity
+from storage_index import StorageIndex
+from storage import create_storage
+from serving import attachment_header, file_response, iter_zip
+from ingest import iter_link_batches, SUPPORTED_EXTENSIONS
+from ratelimit import PlatformLimiter, PlatformUnavailable
+from passthrough import PassThrough, StreamError, MAX_STREAMS, missing_formats
+from formats import format_options, MODES
+from metadata import MetadataCache, info_summary, PROBE_WORKERS, MAX_SESSION_PROBES
+from logs import setup_logging
+from persistence import BatchWriter, ensure_indexes, find_page, PAGE_SIZE
+from database import LazyDatabase
+from health import Readiness
+import metrics
 
 # Load environment variables from .env file
 load_dotenv()
 
-# Set up logging configuration
-logging.basicConfig(
-    filename="app.log",
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-)
+# Set up logging configuration: records are queued and written by a background thread,
+# with LOG_LEVEL and LOG_SAMPLE_RATE controlling how much is kept
+setup_logging()
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
+# Routes are collected here and mounted by create_app() at the bottom of this module
+router = APIRouter()
 
-# CORS configuration - Add first to ensure CORS headers are applied
+# CORS configuration
 origins = [
     "http://localhost:5173",
     "https://social-video-downloader-1.onrender.com",
 ]
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=origins,
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
 
 # Middleware to handle session cookies - Add after CORSMiddleware
 class SessionCookieMiddleware(BaseHTTPMiddleware):
@@ -58,10 +70,7 @@ class SessionCookieMiddleware(BaseHTTPMiddleware):
         )
         return response
 
-app.add_middleware(SessionCookieMiddleware)
-
 # Custom exception handler to ensure CORS headers are included in error responses
-@app.exception_handler(HTTPException)
 async def http_exception_handler(request: Request, exc: HTTPException):
     headers = {
         "Access-Control-Allow-Origin": "https://social-video-downloader-1.onrender.com",
@@ -83,27 +92,17 @@ async def get_session_id(request: Request):
         raise HTTPException(status_code=400, detail="Session ID not found")
     return session_id
 
-# Test ffmpeg availability
-try:
-    result = subprocess.run(["ffmpeg", "-version"], capture_output=True, text=True, check=True)
-    logger.info(f"ffmpeg is installed and accessible: {result.stdout.splitlines()[0]}")
-except subprocess.CalledProcessError as e:
-    logger.error(f"ffmpeg check failed: {e}")
-except FileNotFoundError:
-    logger.error("ffmpeg is not found in PATH. Please ensure ffmpeg is installed and added to your PATH.")
-
-# Connect to MongoDB Atlas
-try:
-    MONGODB_URI = os.getenv("MONGODB_URI", "mongodb://localhost:27017")
-    client = AsyncIOMotorClient(MONGODB_URI)
-    db = client["video_downloader"]
-    links_collection = db["links"]
-    downloads_collection = db["downloads"]
-    files_collection = db["files"]  # New collection for file metadata
-    logger.info("Connected to MongoDB Atlas successfully")
-except Exception as e:
-    logger.error(f"Failed to connect to MongoDB Atlas: {str(e)}")
-    raise Exception("MongoDB connection failed")
+# MongoDB Atlas (MONGODB_URI). The client is created by the startup hook, off the event
+# loop; ffmpeg and MongoDB are probed there too, and reported by /readyz.
+db = LazyDatabase()
+links_collection = db["links"]
+downloads_collection = db["downloads"]
+files_collection = db["files"]  # New collection for file metadata
+jobs_collection = db["jobs"]  # Per-link state of submitted download jobs
+queue_collection = db["queue"]  # One leased work item per job link, shared by all workers
+metadata_collection = db["metadata"]  # Pre-flight probe results, expired by a TTL index
+names_collection = db["names"]  # One document per stored file name, so workers never pick the same one
+readiness = Readiness()
 
 DOWNLOAD_FOLDER = "downloads"
 
@@ -113,6 +112,89 @@ except Exception as e:
     logger.error(f"Failed to create downloads folder: {str(e)}")
     raise Exception(f"Failed to create downloads folder: {str(e)}")
 
+# Downloads run on a bounded worker pool so the event loop stays free for other requests
+scheduler = DownloadScheduler()
+# Progress events from the workers are fanned out to WebSocket subscribers
+progress_broker = ProgressBroker()
+
+def on_worker_event(channels, event: dict):
+    if event["type"] == "stage":
+        metrics.STAGE_SECONDS.observe(event["stage"], event["seconds"])
+    else:
+        progress_broker.publish(channels, event)
+
+scheduler.on_event = on_worker_event
+
+# History and file records are written in bulk_write batches shared by concurrent downloads
+downloads_writer = BatchWriter(downloads_collection)
+files_writer = BatchWriter(files_collection)
+
+# Finished downloads are shared across sessions, keyed by video identity and format
+download_cache = DownloadCache()
+# Pre-flight probes get their own, wider pool so validating a batch doesn't wait on downloads
+probe_scheduler = DownloadScheduler(kind="thread", workers=PROBE_WORKERS, max_concurrent=PROBE_WORKERS, max_per_session=MAX_SESSION_PROBES)
+metadata_cache = MetadataCache(metadata_collection)
+# Requests are paced per platform, backing off when a platform throttles or blocks us
+rate_limiter = PlatformLimiter()
+# Finished files live on local disk or in an S3-compatible bucket (STORAGE_BACKEND)
+storage = create_storage(DOWNLOAD_FOLDER)
+# Per-session byte totals and file records, kept current as files land or are evicted
+storage_index = StorageIndex(storage)
+
+# Storage is shared by every worker, so a file name is only used once its document is
+# inserted; the _id makes a second insert of the same name fail
+async def claim_file_name(session_id: str, filename: str) -> bool:
+    try:
+        await names_collection.insert_one({"_id": f"{session_id}/{filename}", "session_id": session_id, "created_at": datetime.now(timezone.utc)})
+    except DuplicateKeyError:
+        return False
+    return True
+
+async def release_file_name(session_id: str, filename: str):
+    try:
+        await names_collection.delete_one({"_id": f"{session_id}/{filename}"})
+    except Exception as e:
+        logger.error(f"Failed to release file name {filename} in session {session_id}: {str(e)}")
+
+# Evicted files leave the listings with their storage
+async def on_file_evicted(session_id: str, filename: str):
+    try:
+        await files_collection.delete_many({"session_id": session_id, "filename": filename})
+    except Exception as e:
+        logger.error(f"Failed to remove file metadata for evicted {filename} in session {session_id}: {str(e)}")
+    await release_file_name(session_id, filename)
+
+storage_index.on_evict = on_file_evicted
+storage_index.claim_name = claim_file_name
+
+# Startup work left running in the background. References are kept so the tasks aren't
+# collected mid-run, and failures are logged instead of lost with the task.
+background_tasks = set()
+
+def on_background_done(task: asyncio.Task):
+    background_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"Background task {task.get_name()} failed: {str(task.exception())}", exc_info=task.exception())
+
+def run_in_background(coro, name: str) -> asyncio.Task:
+    task = asyncio.create_task(coro, name=name)
+    background_tasks.add(task)
+    task.add_done_callback(on_background_done)
+    return task
+
+async def start_scheduler():
+    scheduler.start()
+    probe_scheduler.start()
+    storage_index.start()
+    run_in_background(download_cache.load(), "download cache load")
+
+async def shutdown_scheduler():
+    scheduler.shutdown(wait=False)
+    probe_scheduler.shutdown(wait=False)
+    storage_index.shutdown()
+    await downloads_writer.flush()
+    await files_writer.flush()
+
 def get_platform(link: str) -> str:
     if "instagram.com" in link:
         return "instagram"
@@ -122,261 +204,671 @@ def get_platform(link: str) -> str:
         return "x"
     return "unknown"
 
-def sanitize_filename(filename: str) -> str:
-    return re.sub(r'[^\w\s-]', '', filename).replace(' ', '_')
-
-def cleanup_downloads_folder(session_id: str):
-    MAX_FOLDER_SIZE = 5 * 1024 * 1024 * 1024  # 5GB limit per user
-    user_downloads_dir = os.path.join(DOWNLOAD_FOLDER, session_id)
+async def fetch_and_download(link: str, ydl_opts: dict, session_id: str, user_downloads_dir: str, channels: list, total: int, current: int):
+    # Reuse the pre-flight probe, if there is one, instead of resolving the page again
+    info = await metadata_cache.get(link, ydl_opts["format"])
+    platform = get_platform(link)
+    await rate_limiter.acquire(platform)
+    metrics.IN_FLIGHT.inc(platform)
     try:
-        os.makedirs(user_downloads_dir, exist_ok=True)
-        folder_size = sum(
-            os.path.getsize(os.path.join(user_downloads_dir, f))
-            for f in os.listdir(user_downloads_dir)
-            if os.path.isfile(os.path.join(user_downloads_dir, f))
+        saved_files = await scheduler.run(
+            session_id, run_download, link, ydl_opts, user_downloads_dir, scheduler.events, channels, total, current, info
         )
-        if folder_size > MAX_FOLDER_SIZE:
-            logger.info(f"User {session_id} downloads folder size ({folder_size} bytes) exceeds limit ({MAX_FOLDER_SIZE} bytes). Cleaning up...")
-            files = sorted(
-                os.listdir(user_downloads_dir),
-                key=lambda x: os.path.getmtime(os.path.join(user_downloads_dir, x))
-            )
-            for file in files:
-                file_path = os.path.join(user_downloads_dir, file)
-                if os.path.isfile(file_path):
-                    file_size = os.path.getsize(file_path)
-                    os.remove(file_path)
-                    folder_size -= file_size
-                    logger.info(f"Deleted {file_path} ({file_size} bytes) for user {session_id}")
-                    if folder_size <= MAX_FOLDER_SIZE:
-                        break
     except Exception as e:
-        logger.error(f"Error during downloads folder cleanup for user {session_id}: {str(e)}")
+        rate_limiter.record(platform, e)
+        raise
+    finally:
+        metrics.IN_FLIGHT.dec(platform)
+    rate_limiter.record(platform)
+    metrics.DOWNLOADED_BYTES.inc(platform, sum(saved["size"] for saved in saved_files))
+    return saved_files
+
+# Private directory for one download under the session's folder. Downloads of a session
+# run concurrently and yt-dlp names files after the title, so each gets its own.
+async def new_work_dir(session_id: str) -> str:
+    work_dir = os.path.join(DOWNLOAD_FOLDER, session_id, f".work-{uuid.uuid4().hex}")
+    await asyncio.to_thread(os.makedirs, work_dir)
+    return work_dir
+
+# Move finished files into storage under names unique within the session, across every
+# worker, index them and record them in MongoDB. Returns the records as stored.
+async def record_saved_files(session_id: str, work_dir: str, saved_files: list, job_id: str = None):
+    recorded = []
+    for saved in saved_files:
+        name = await storage_index.reserve(session_id, saved["filename"])
+        try:
+            await asyncio.to_thread(storage.save, session_id, name, os.path.join(work_dir, saved["filename"]))
+        except Exception:
+            storage_index.forget(session_id, name)
+            await release_file_name(session_id, name)
+            raise
+        await storage_index.record(session_id, name, saved["size"])
+        recorded.append({**saved, "filename": name})
+    now = datetime.now(timezone.utc)
+    stored = await asyncio.gather(*[
+        files_writer.insert({"session_id": session_id, "job_id": job_id, **saved, "created_at": now})
+        for saved in recorded
+    ], return_exceptions=True)
+    for saved, outcome in zip(recorded, stored):
+        if isinstance(outcome, Exception):
+            logger.error(f"Failed to store file metadata for {saved['filename']} in session {session_id}: {str(outcome)}")
+        else:
+            logger.info(f"Stored file metadata in MongoDB: {saved['filename']} ({saved['size']} bytes) for session {session_id}")
+    return recorded
 
-async def download_single_video(link: str, ydl_opts: dict, session_id: str, total: int = 1, current: int = 1):
-    user_downloads_dir = os.path.join(DOWNLOAD_FOLDER, session_id)
-    os.makedirs(user_downloads_dir, exist_ok=True)
-
-    def progress_hook(d):
-        if d.get('status') == 'finished':
-            final_filename = d.get('filename')
-            if final_filename and os.path.exists(final_filename):
-                base, ext = os.path.splitext(final_filename)
-                sanitized_base = sanitize_filename(base)
-                new_filename = f"{sanitized_base}.mp4"
-                new_filepath = os.path.join(user_downloads_dir, new_filename)
-                try:
-                    os.rename(final_filename, new_filepath)
-                    logger.info(f"Renamed file to: {new_filepath}")
-                    # Store file metadata in MongoDB
-                    file_size = os.path.getsize(new_filepath)
-                    asyncio.create_task(files_collection.insert_one({
-                        "session_id": session_id,
-                        "filename": new_filename,
-                        "size": file_size
-                    }))
-                    logger.info(f"Stored file metadata in MongoDB: {new_filename} ({file_size} bytes) for session {session_id}")
-                except Exception as e:
-                    logger.error(f"Failed to rename file {final_filename} to {new_filepath}: {str(e)}")
-
-    ydl_opts["outtmpl"] = f"{user_downloads_dir}/%(title)s.%(ext)s"
-    ydl_opts["progress_hooks"] = [progress_hook]
-    ydl_opts["merge_output_format"] = "mp4"
-    ydl_opts["cookiefile"] = "cookies.txt"  # Use cookies file for authentication
+async def download_single_video(link: str, ydl_opts: dict, session_id: str, total: int = 1, current: int = 1, job_id: str = None):
+    channels = [session_channel(session_id)] + ([job_channel(job_id)] if job_id else [])
+    platform = get_platform(link)
+    work_dir = None
 
     try:
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            logger.info(f"Starting download for {link} in session {session_id}")
-            ydl.download([link])
-            files_after = os.listdir(user_downloads_dir)
-            logger.info(f"Files in {user_downloads_dir} after download: {files_after}")
-            if not files_after:
-                raise Exception("No files were created after download")
-            result = {"link": link, "status": "success"}
-            # Insert download history into MongoDB with error handling
-            try:
-                await downloads_collection.insert_one({"session_id": session_id, "link": link, "status": "success"})
-                logger.info(f"Successfully inserted download history for {link} in session {session_id}")
-            except Exception as e:
-                logger.error(f"Failed to insert download history for {link} in session {session_id}: {str(e)}")
-            logger.info(f"Successfully downloaded {link} in session {session_id}")
-            return result
+        key = cache_key(await asyncio.to_thread(video_identity, link), ydl_opts["format"])
+        logger.info(f"Queueing download for {link} in session {session_id}")
+        work_dir = await new_work_dir(session_id)
+        saved_files, cache_hit = await download_cache.get_or_download(
+            key, work_dir, link,
+            lambda: fetch_and_download(link, ydl_opts, session_id, work_dir, channels, total, current),
+        )
+        if cache_hit:
+            logger.info(f"Served {link} from the download cache for session {session_id}")
+        await record_saved_files(session_id, work_dir, saved_files, job_id)
+        result = {"link": link, "status": "success"}
+        # Insert download history into MongoDB with error handling
+        try:
+            await downloads_writer.insert({"session_id": session_id, "link": link, "status": "success", "created_at": datetime.now(timezone.utc)})
+            logger.info(f"Successfully inserted download history for {link} in session {session_id}")
+        except Exception as e:
+            logger.error(f"Failed to insert download history for {link} in session {session_id}: {str(e)}")
+        logger.info(f"Successfully downloaded {link} in session {session_id}")
+        metrics.DOWNLOADS.inc((platform, "success"))
+        progress_broker.publish(channels, {"type": "link", "current": current, "total": total, **result})
+        return result
     except Exception as e:
         logger.error(f"Failed to download {link} in session {session_id}: {str(e)}")
         result = {"link": link, "status": "failed", "error": str(e)}
         # Insert failed download history into MongoDB with error handling
+        metrics.DOWNLOADS.inc((platform, "failed"))
         try:
-            await downloads_collection.insert_one({"session_id": session_id, "link": link, "status": "failed", "error": str(e)})
+            await downloads_writer.insert({
+                "session_id": session_id, "link": link, "status": "failed", "error": str(e), "created_at": datetime.now(timezone.utc),
+            })
             logger.info(f"Successfully inserted failed download history for {link} in session {session_id}")
         except Exception as e:
             logger.error(f"Failed to insert failed download history for {link} in session {session_id}: {str(e)}")
+        progress_broker.publish(channels, {"type": "link", "current": current, "total": total, **result})
         return result
+    finally:
+        if work_dir is not None:
+            await asyncio.to_thread(shutil.rmtree, work_dir, True)
+
+def build_ydl_opts(link: str, mode: str = "video") -> dict:
+    platform = get_platform(link)
+    ydl_opts = {
+        "noplaylist": True,
+        "retries": rate_limiter.retries(platform),
+        "fragment_retries": rate_limiter.retries(platform),
+        "extractor_retries": rate_limiter.retries(platform),
+        "abort_on_unavailable_fragments": False,
+        "cookiefile": "cookies.txt",  # Use cookies file for authentication
+        "http_headers": {
+            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
+        },
+    }
+    ydl_opts.update(transfer_options())
+    ydl_opts.update(format_options(platform, mode))
+    return ydl_opts
+
+async def probe_link(link: str, session_id: str, mode: str = "video", refresh: bool = False) -> dict:
+    ydl_opts = build_ydl_opts(link, mode)
+    info = None if refresh else await metadata_cache.get(link, ydl_opts["format"])
+    if info is None:
+        platform = get_platform(link)
+        await rate_limiter.acquire(platform)
+        try:
+            info = await probe_scheduler.run(session_id, run_probe, link, ydl_opts)
+        except Exception as e:
+            rate_limiter.record(platform, e)
+            raise
+        rate_limiter.record(platform)
+        await metadata_cache.put(link, ydl_opts["format"], info)
+    return info
+
+async def preflight_links(links: List[str], session_id: str, mode: str = "video") -> dict:
+    async def _probe(link):
+        try:
+            return {"link": link, "status": "ok", **info_summary(await probe_link(link, session_id, mode))}
+        except Exception as e:
+            logger.warning(f"Pre-flight probe failed for {link} in session {session_id}: {str(e)}")
+            return {"link": link, "status": "failed", "error": str(e)}
+
+    results = await asyncio.gather(*[_probe(link) for link in links])
+    ok = [r for r in results if r["status"] == "ok"]
+    return {
+        "links": results,
+        "ok": len(ok),
+        "failed": len(results) - len(ok),
+        "estimated_bytes": sum(r["filesize"] or 0 for r in ok),
+        "estimated_duration": sum(r["duration"] or 0 for r in ok),
+    }
+
+async def download_link(link: str, session_id: str, total: int = 1, current: int = 1, job_id: str = None, mode: str = "video"):
+    return await download_single_video(link, build_ydl_opts(link, mode), session_id, total, current, job_id)
+
+# One page of a playlist, channel or profile for an expanded job. A link that turns out
+# to be a single video comes back as itself, and its probe is cached for the download.
+async def expand_link(link: str, session_id: str, start: int, count: int, mode: str = "video"):
+    ydl_opts = build_ydl_opts(link, mode)
+    platform = get_platform(link)
+    await rate_limiter.acquire(platform)
+    try:
+        links, collections, more, info = await probe_scheduler.run(session_id, run_expand_page, link, ydl_opts, start, count)
+    except Exception as e:
+        rate_limiter.record(platform, e)
+        raise
+    rate_limiter.record(platform)
+    if info is not None:
+        await metadata_cache.put(link, ydl_opts["format"], info)
+    return links, collections, more
 
 async def download_videos(links: List[str], session_id: str):
     total = len(links)
     tasks = []
     for i, link in enumerate(links):
-        await asyncio.sleep(0.5)  # Reduced delay to improve performance
-        platform = get_platform(link)
-        ydl_opts = {
-            "verbose": True,
-            "noplaylist": True,
-            "retries": 20,
-            "fragment_retries": 20,
-            "abort_on_unavailable_fragments": False,
-            "logger": logging.getLogger(),
-            "http_headers": {
-                "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"
-            },
-        }
-        if platform == "instagram":
-            ydl_opts["format"] = "bestvideo[height<=720]+bestaudio/best"
-            ydl_opts["merge_output_format"] = "mp4"
-        else:
-            ydl_opts["format"] = "best[height<=720]"
-            ydl_opts["merge_output_format"] = "mp4"
-
-        tasks.append(download_single_video(link, ydl_opts, session_id, total, i + 1))
+        tasks.append(download_link(link, session_id, total, i + 1))
     
     results = await asyncio.gather(*tasks, return_exceptions=True)
     return results
 
-@app.get("/")
+# Download batches are tracked as jobs in MongoDB so clients can poll them. Their links go
+# through a leased queue that every worker process claims from, so work left behind by a
+# dead worker is picked up by the others. With expand=true, submitted links are treated as
+# playlists, channels or profiles and resolved into video links a page at a time.
+job_manager = JobManager(
+    jobs_collection, queue_collection, download_link, progress_broker, expand=expand_link, max_per_session=scheduler.max_per_session
+)
+
+async def start_jobs():
+    job_manager.start()
+
+async def shutdown_jobs():
+    await job_manager.shutdown()
+
+async def prepare_session_download(session_id: str):
+    await storage_index.enforce_quota(session_id)
+    await downloads_collection.delete_many({"session_id": session_id})
+    await files_collection.delete_many({"session_id": session_id})  # Clear previous file metadata
+
+def job_results(job: dict) -> list:
+    results = []
+    for item in job["links"]:
+        result = {"link": item["link"], "status": "success" if item["status"] == "done" else "failed"}
+        if item["status"] != "done":
+            result["error"] = item.get("error") or f"Download {item['status']}"
+        results.append(result)
+    return results
+
+@router.get("/")
 async def root():
     return {"message": "Welcome to the Social Video Downloader API. Visit /docs for API documentation."}
 
-@app.post("/upload-excel/")
-async def upload_excel(file: UploadFile):
-    if not file.filename.endswith(".xlsx"):
+# Liveness: the process is up and serving. Checks nothing else, so a slow database never
+# gets a replica restarted.
+@router.get("/healthz")
+async def healthz():
+    return {"status": "ok"}
+
+# Readiness: MongoDB answers and ffmpeg is installed. Returns 503 until then, so new
+# replicas get traffic only once they can handle it.
+@router.get("/readyz")
+async def readyz():
+    report = await readiness.report(db)
+    return JSONResponse(status_code=200 if readiness.ready else 503, content=report)
+
+@router.get("/metrics")
+async def get_metrics():
+    metrics.QUEUE_DEPTH.set(("download", "queued"), scheduler.queued)
+    metrics.QUEUE_DEPTH.set(("download", "running"), scheduler.running)
+    metrics.QUEUE_DEPTH.set(("probe", "queued"), probe_scheduler.queued)
+    metrics.QUEUE_DEPTH.set(("probe", "running"), probe_scheduler.running)
+    metrics.QUEUE_DEPTH.set(("jobs", "running"), job_manager.active)
+    try:
+        metrics.QUEUE_DEPTH.set(("jobs", "queued"), await queue_collection.count_documents({"status": "queued"}))
+    except Exception as e:
+        logger.warning(f"Failed to count queued job links for metrics: {str(e)}")
+    for name, cache in (("download", download_cache), ("metadata", metadata_cache)):
+        stats = cache.stats()
+        metrics.record_cache(name, stats["hits"], stats["misses"])
+    for platform, state in rate_limiter.stats().items():
+        metrics.PLATFORM_RATE.set(platform, state["rate"])
+        metrics.CIRCUIT_OPEN.set(platform, 0 if state["circuit"] == "closed" else 1)
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+def check_mode(mode: str):
+    if mode not in MODES:
+        raise HTTPException(status_code=400, detail=f"Unknown download mode '{mode}'. Use one of: {', '.join(MODES)}")
+
+async def session_links(session_id: str) -> List[str]:
+    cursor = links_collection.find({"session_id": session_id}, {"_id": 0, "link": 1}).sort("position", 1)
+    return [item["link"] async for item in cursor]
+
+@router.post("/upload-excel/")
+async def upload_excel(file: UploadFile, session_id: str = Depends(get_session_id)):
+    if not file.filename.lower().endswith(SUPPORTED_EXTENSIONS):
         logger.warning(f"Invalid file format uploaded: {file.filename}")
-        raise HTTPException(status_code=400, detail="Please upload an Excel file (.xlsx)")
+        raise HTTPException(status_code=400, detail="Please upload an Excel (.xlsx) or CSV (.csv) file")
 
     MAX_FILE_SIZE = 10 * 1024 * 1024
-    content = await file.read()
-    if len(content) > MAX_FILE_SIZE:
-        logger.warning(f"File size exceeds limit: {file.filename} ({len(content)} bytes)")
+    if file.size is not None and file.size > MAX_FILE_SIZE:
+        logger.warning(f"File size exceeds limit: {file.filename} ({file.size} bytes)")
         raise HTTPException(status_code=400, detail="File size exceeds 10MB limit")
 
-    temp_file = f"temp_{file.filename}"
-    try:
-        with open(temp_file, "wb") as buffer:
-            buffer.write(content)
-        logger.info(f"Saved temporary file: {temp_file}")
-    except Exception as e:
-        logger.error(f"Failed to save uploaded file {file.filename}: {str(e)}")
-        raise HTTPException(status_code=500, detail="Failed to save the uploaded file. Please try again.")
-
+    # Rows are parsed lazily straight from the upload and inserted in bounded batches
+    stats = {}
+    position = 0
     try:
-        df = pd.read_excel(temp_file, usecols=["video_link"])
-        df.columns = df.columns.str.strip().str.lower()
-        if "video_link" not in df.columns:
-            logger.error("Excel file missing 'video_link' column")
-            raise ValueError("Excel file must contain a 'video_link' column")
-        links = df["video_link"].dropna().tolist()
-        await links_collection.delete_many({})
-        await links_collection.insert_many([{"link": link} for link in links])
-        logger.info(f"Uploaded Excel file with {len(links)} links")
-        return {"links": links}
+        await links_collection.delete_many({"session_id": session_id})
+        batches = iterate_in_threadpool(iter_link_batches(file.file, file.filename, stats))
+        async for batch in batches:
+            await links_collection.insert_many([
+                {"session_id": session_id, "link": link, "position": position + i} for i, link in enumerate(batch)
+            ])
+            position += len(batch)
+        logger.info(f"Uploaded {file.filename} with {stats['count']} links ({stats['duplicates']} duplicates, {stats['skipped']} skipped) for session {session_id}")
+        return stats
     except Exception as e:
         logger.error(f"Error reading Excel file {file.filename}: {str(e)}")
+        try:
+            await links_collection.delete_many({"session_id": session_id})  # Drop a partially ingested sheet
+        except Exception as e:
+            logger.warning(f"Failed to remove partially ingested links for session {session_id}: {str(e)}")
         raise HTTPException(status_code=400, detail="Error reading the Excel file. Please ensure it has a 'video_link' column.")
-    finally:
-        if os.path.exists(temp_file):
-            try:
-                os.remove(temp_file)
-                logger.info(f"Deleted temporary file: {temp_file}")
-            except Exception as e:
-                logger.warning(f"Failed to delete temp file {temp_file}: {str(e)}")
 
-@app.post("/download-all/")
-async def download_all(session_id: str = Depends(get_session_id)):
+@router.post("/download-all/")
+async def download_all(mode: str = Query("video"), expand: bool = Query(False), session_id: str = Depends(get_session_id)):
+    check_mode(mode)
     logger.info(f"Received download-all request for session {session_id}")
-    links = [item["link"] async for item in links_collection.find({}, {"_id": 0, "link": 1})]
+    links = await session_links(session_id)
     if not links:
         logger.warning(f"No video links available for download-all in session {session_id}")
         raise HTTPException(status_code=400, detail="No video links available. Please upload an Excel file first.")
     
     try:
-        logger.info(f"Links to download for session {session_id}: {links}")
-        cleanup_downloads_folder(session_id)
-        await downloads_collection.delete_many({"session_id": session_id})
-        await files_collection.delete_many({"session_id": session_id})  # Clear previous file metadata
-        results = await download_videos(links, session_id)
-        logger.info(f"Completed download-all with {len(results)} results for session {session_id}: {results}")
-        return {"results": results}
+        logger.info(f"Downloading {len(links)} links for session {session_id}")
+        await prepare_session_download(session_id)
+        job = await job_manager.create(session_id, links, {"mode": mode}, expand=expand)
+        results = job_results(await job_manager.wait(job["_id"]))
+        logger.info(f"Completed download-all with {len(results)} results for session {session_id}")
+        return {"job_id": job["_id"], "results": results}
     except Exception as e:
         logger.error(f"Error in download-all for session {session_id}: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to download videos: {str(e)}")
 
-@app.post("/download-single/")
-async def download_single(link: str = Query(...), session_id: str = Depends(get_session_id)):
+@router.post("/download-single/")
+async def download_single(link: str = Query(...), mode: str = Query("video"), expand: bool = Query(False), session_id: str = Depends(get_session_id)):
+    check_mode(mode)
     if not link:
         logger.warning(f"No video link provided for download-single in session {session_id}")
         raise HTTPException(status_code=400, detail="Please provide a video link.")
     
     try:
-        cleanup_downloads_folder(session_id)
-        await downloads_collection.delete_many({"session_id": session_id})
-        await files_collection.delete_many({"session_id": session_id})  # Clear previous file metadata
-        results = await download_videos([link], session_id)
-        logger.info(f"Completed download-single for {link} in session {session_id}: {results}")
-        return {"results": results}
+        await prepare_session_download(session_id)
+        job = await job_manager.create(session_id, [link], {"mode": mode}, expand=expand)
+        results = job_results(await job_manager.wait(job["_id"]))
+        logger.info(f"Completed download-single for {link} in session {session_id} with {len(results)} results")
+        return {"job_id": job["_id"], "results": results}
     except Exception as e:
         logger.error(f"Error in download-single for {link} in session {session_id}: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to download the video. Please try again.")
 
-@app.get("/downloads/list-files/")
-async def list_downloaded_files(session_id: str = Depends(get_session_id)):
+@router.post("/preflight/")
+async def preflight(link: str = Query(None), mode: str = Query("video"), session_id: str = Depends(get_session_id)):
+    check_mode(mode)
+    if link:
+        links = [link]
+    else:
+        links = await session_links(session_id)
+    if not links:
+        logger.warning(f"No video links available for preflight in session {session_id}")
+        raise HTTPException(status_code=400, detail="No video links available. Please upload an Excel file first.")
+    try:
+        report = await preflight_links(links, session_id, mode)
+        logger.info(f"Pre-flight for session {session_id}: {report['ok']} ok, {report['failed']} failed")
+        return report
+    except Exception as e:
+        logger.error(f"Error in preflight for session {session_id}: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to check the video links. Please try again.")
+
+@router.post("/jobs/download-all/", status_code=202)
+async def submit_download_all_job(preflight: bool = Query(False), mode: str = Query("video"), expand: bool = Query(False), session_id: str = Depends(get_session_id)):
+    check_mode(mode)
+    links = await session_links(session_id)
+    if not links:
+        logger.warning(f"No video links available for download-all job in session {session_id}")
+        raise HTTPException(status_code=400, detail="No video links available. Please upload an Excel file first.")
+    if preflight and expand:
+        raise HTTPException(status_code=400, detail="Pre-flight checks can't be combined with expand.")
+
+    if preflight:
+        report = await preflight_links(links, session_id, mode)
+        if report["failed"]:
+            failed = [{"link": r["link"], "error": r["error"]} for r in report["links"] if r["status"] == "failed"]
+            logger.warning(f"Rejected download-all job for session {session_id}: {len(failed)} links failed pre-flight")
+            raise HTTPException(status_code=422, detail={"message": "Some video links can't be downloaded", "failed": failed})
+
+    try:
+        await prepare_session_download(session_id)
+        job = await job_manager.create(session_id, links, {"mode": mode}, expand=expand)
+        return job_summary({k: v for k, v in job.items() if k != "links"})
+    except Exception as e:
+        logger.error(f"Error submitting download-all job for session {session_id}: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to submit the download job. Please try again.")
+
+@router.post("/jobs/download-single/", status_code=202)
+async def submit_download_single_job(link: str = Query(...), mode: str = Query("video"), expand: bool = Query(False), session_id: str = Depends(get_session_id)):
+    check_mode(mode)
+    if not link:
+        logger.warning(f"No video link provided for download-single job in session {session_id}")
+        raise HTTPException(status_code=400, detail="Please provide a video link.")
+
+    try:
+        await prepare_session_download(session_id)
+        job = await job_manager.create(session_id, [link], {"mode": mode}, expand=expand)
+        return job_summary({k: v for k, v in job.items() if k != "links"})
+    except Exception as e:
+        logger.error(f"Error submitting download-single job for {link} in session {session_id}: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to submit the download job. Please try again.")
+
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: str, include_links: bool = Query(False), session_id: str = Depends(get_session_id)):
+    try:
+        job = await job_manager.get(job_id, session_id, include_links=include_links)
+    except Exception as e:
+        logger.error(f"Error fetching job {job_id} for session {session_id}: {str(e)}")
+        raise HTTPException(status_code=500, detail="Failed to fetch the job status. Please try again.")
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job_summary(job)
+
+WS_PING_INTERVAL = 15  # seconds of silence before a ping, so dead clients are noticed
+WS_JOB_POLL_INTERVAL = 2  # seconds between job document checks while a job stream is quiet
+
+# on_idle, if given, is awaited whenever no event arrived in time and may return an event
+# to send instead of a ping
+async def stream_progress(websocket: WebSocket, events: asyncio.Queue, stop_on_job_end: bool = False, on_idle=None, idle_timeout: float = WS_PING_INTERVAL):
+    while True:
+        try:
+            event = await asyncio.wait_for(events.get(), timeout=idle_timeout)
+        except asyncio.TimeoutError:
+            event = (await on_idle() if on_idle is not None else None) or {"type": "ping"}
+        await websocket.send_json(event)
+        if stop_on_job_end and event["type"] == "job":
+            return
+
+@router.websocket("/ws/progress")
+async def session_progress(websocket: WebSocket):
+    session_id = websocket.cookies.get("session_id")
+    if not session_id:
+        await websocket.close(code=1008, reason="Session ID not found")
+        return
+    await websocket.accept()
+    try:
+        with progress_broker.subscribe(session_channel(session_id)) as events:
+            await stream_progress(websocket, events)
+    except WebSocketDisconnect:
+        logger.info(f"Progress WebSocket closed for session {session_id}")
+
+@router.websocket("/ws/jobs/{job_id}")
+async def job_progress(websocket: WebSocket, job_id: str):
+    session_id = websocket.cookies.get("session_id")
+    job = await job_manager.get(job_id, session_id, include_links=False) if session_id else None
+    if job is None:
+        await websocket.close(code=1008, reason="Job not found")
+        return
+    await websocket.accept()
+    last_counts = job["counts"]
+
+    # Links run on other workers publish their events there, so a quiet stream falls back
+    # to the job document for counts and completion
+    async def poll_job():
+        nonlocal last_counts
+        current = await job_manager.get(job_id, session_id, include_links=False)
+        if current is None:
+            return None
+        if current["status"] in ("done", "failed"):
+            return {"type": "job", "job_id": job_id, "status": current["status"]}
+        if current["counts"] != last_counts:
+            last_counts = current["counts"]
+            return jsonable_encoder({"type": "snapshot", **job_summary(current)})
+        return None
+
     try:
-        # First, check the filesystem for any existing files
-        user_downloads_dir = os.path.join(DOWNLOAD_FOLDER, session_id)
-        os.makedirs(user_downloads_dir, exist_ok=True)
-        files = os.listdir(user_downloads_dir)
-        video_files = [
-            {"name": f, "size": os.path.getsize(os.path.join(user_downloads_dir, f))}
-            for f in files if f.endswith(".mp4")
-        ]
-        logger.info(f"Listed {len(video_files)} downloaded files from filesystem for session {session_id}: {[f['name'] for f in video_files]}")
-
-        # Also fetch file metadata from MongoDB
-        mongo_files = [item async for item in files_collection.find({"session_id": session_id}, {"_id": 0, "filename": 1, "size": 1})]
-        mongo_files = [{"name": f["filename"], "size": f["size"]} for f in mongo_files]
-        logger.info(f"Fetched {len(mongo_files)} downloaded files from MongoDB for session {session_id}: {[f['name'] for f in mongo_files]}")
-
-        # Combine filesystem and MongoDB results, avoiding duplicates
-        combined_files = {f["name"]: f for f in video_files}
-        for mongo_file in mongo_files:
-            if mongo_file["name"] not in combined_files:
-                combined_files[mongo_file["name"]] = mongo_file
-
-        final_files = list(combined_files.values())
-        logger.info(f"Final list of {len(final_files)} downloaded files for session {session_id}: {[f['name'] for f in final_files]}")
-        return {"files": final_files}
+        # Subscribe before sending the snapshot so no event falls in between
+        with progress_broker.subscribe(job_channel(job_id)) as events:
+            await websocket.send_json(jsonable_encoder({"type": "snapshot", **job_summary(job)}))
+            if job["status"] in ("done", "failed"):
+                await websocket.close()
+                return
+            await stream_progress(websocket, events, stop_on_job_end=True, on_idle=poll_job, idle_timeout=WS_JOB_POLL_INTERVAL)
+        await websocket.close()
+    except WebSocketDisconnect:
+        logger.info(f"Progress WebSocket closed for job {job_id}")
+
+# Files this worker indexed, plus those other workers recorded in MongoDB
+async def session_files(session_id: str) -> list:
+    combined_files = {f["name"]: f for f in await storage_index.list_files(session_id)}
+    async for item in files_collection.find({"session_id": session_id}, {"_id": 0, "filename": 1, "size": 1}):
+        combined_files.setdefault(item["filename"], {"name": item["filename"], "size": item["size"]})
+    return list(combined_files.values())
+
+# Files still on storage whose MongoDB records were cleared, listed after the last page
+async def unrecorded_files(session_id: str) -> list:
+    indexed = {f["name"]: f for f in await storage_index.list_files(session_id)}
+    if not indexed:
+        return []
+    cursor = files_collection.find({"session_id": session_id, "filename": {"$in": list(indexed)}}, {"_id": 0, "filename": 1})
+    async for item in cursor:
+        indexed.pop(item["filename"], None)
+    return list(indexed.values())
+
+# Paged, newest first, when limit or cursor is given; otherwise every file at once, as
+# clients written before paging expect
+@router.get("/downloads/list-files/")
+async def list_downloaded_files(limit: int = Query(None), cursor: str = Query(None), session_id: str = Depends(get_session_id)):
+    try:
+        if limit is None and cursor is None:
+            files = await session_files(session_id)
+            logger.info(f"Listed {len(files)} downloaded files for session {session_id}")
+            return {"files": files, "next_cursor": None}
+        page, next_cursor = await find_page(files_collection, {"session_id": session_id}, {"filename": 1, "size": 1}, PAGE_SIZE if limit is None else limit, cursor)
+        files = [{"name": f["filename"], "size": f["size"]} for f in page]
+        if next_cursor is None:
+            seen = {f["name"] for f in files}
+            files.extend(f for f in await unrecorded_files(session_id) if f["name"] not in seen)
+        logger.info(f"Listed {len(files)} downloaded files for session {session_id}")
+        return {"files": files, "next_cursor": next_cursor}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error listing files for session {session_id}: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to list downloaded files. Please try again.")
 
-@app.get("/downloads/file/{filename}")
-async def get_file(filename: str, session_id: str = Depends(get_session_id)):
-    user_downloads_dir = os.path.join(DOWNLOAD_FOLDER, session_id)
-    file_path = os.path.join(user_downloads_dir, filename)
-    if not os.path.exists(file_path):
-        logger.warning(f"File not found: {file_path} for session {session_id}")
+@router.api_route("/downloads/file/{filename}", methods=["GET", "HEAD"])
+async def get_file(filename: str, request: Request, session_id: str = Depends(get_session_id)):
+    try:
+        if filename != os.path.basename(filename) or filename.startswith("."):
+            raise FileNotFoundError(filename)
+        stat_result = await asyncio.to_thread(storage.stat, session_id, filename)
+    except FileNotFoundError:
+        logger.warning(f"File not found: {filename} for session {session_id}")
         raise HTTPException(status_code=404, detail="File not found")
+    url = await asyncio.to_thread(storage.url, session_id, filename)
+    if url is not None:
+        # Object storage serves the bytes (and Range requests) itself
+        logger.info(f"Redirecting to stored file: {filename} for session {session_id}")
+        return RedirectResponse(url, status_code=307)
+    file_path = storage.path(session_id, filename)
     logger.info(f"Serving file: {file_path} for session {session_id}")
-    return FileResponse(file_path, media_type="video/mp4", filename=filename)
+    return file_response(request, file_path, stat_result, filename)
+
+# Pass-through downloads hold a process and a connection each, so they are capped per worker
+stream_slots = asyncio.Semaphore(MAX_STREAMS)
 
-@app.get("/downloads/history/")
-async def get_download_history(session_id: str = Depends(get_session_id)):
+async def keep_streamed_copy(stream: PassThrough, key: str, link: str, session_id: str):
+    work_dir = await new_work_dir(session_id)
     try:
-        downloads = [item async for item in downloads_collection.find({"session_id": session_id}, {"_id": 0})]
-        logger.info(f"Fetched download history with {len(downloads)} entries for session {session_id}: {downloads}")
-        return {"downloads": downloads}
+        await asyncio.to_thread(os.replace, stream.tee_path, os.path.join(work_dir, stream.filename))
+        saved_files = [{"filename": stream.filename, "size": stream.size}]
+        await download_cache.store(key, work_dir, saved_files, link)
+        await record_saved_files(session_id, work_dir, saved_files)
+    finally:
+        await asyncio.to_thread(shutil.rmtree, work_dir, True)
+    await downloads_writer.insert({"session_id": session_id, "link": link, "status": "success", "created_at": datetime.now(timezone.utc)})
+
+# save=true on a cache hit: the cached files are linked into the session's files
+async def keep_cached_copy(key: str, link: str, session_id: str):
+    work_dir = await new_work_dir(session_id)
+    try:
+        saved_files = await download_cache.fetch(key, work_dir)
+        if saved_files is None:
+            return
+        await record_saved_files(session_id, work_dir, saved_files)
+    finally:
+        await asyncio.to_thread(shutil.rmtree, work_dir, True)
+    await downloads_writer.insert({"session_id": session_id, "link": link, "status": "success", "created_at": datetime.now(timezone.utc)})
+
+# Opt-in streaming download: bytes go to the client as yt-dlp (or ffmpeg, for split
+# formats) produces them, instead of after the whole download, merge and rename. With
+# save=true a copy is kept in the session's files and the download cache. Cached videos are
+# served from the cache, and save=true still adds them to the session's files.
+@router.get("/stream/")
+async def stream_download(request: Request, link: str = Query(...), mode: str = Query("video"), save: bool = Query(False), session_id: str = Depends(get_session_id)):
+    check_mode(mode)
+    ydl_opts = build_ydl_opts(link, mode)
+    key = cache_key(await asyncio.to_thread(video_identity, link), ydl_opts["format"])
+    cached = await download_cache.paths(key)
+    if cached:
+        try:
+            stat_result = await asyncio.to_thread(os.stat, cached[0])
+        except FileNotFoundError:
+            # Evicted by another worker since it was indexed here
+            logger.info(f"Cached copy of {link} is gone, streaming it from the source for session {session_id}")
+            cached = None
+    if cached:
+        if save:
+            try:
+                await keep_cached_copy(key, link, session_id)
+            except Exception as e:
+                logger.error(f"Failed to keep a copy of {link} for session {session_id}: {str(e)}")
+        logger.info(f"Streaming {link} from the download cache for session {session_id}")
+        return file_response(request, cached[0], stat_result, os.path.basename(cached[0]))
+
+    if stream_slots.locked():
+        raise HTTPException(status_code=503, detail="Too many streams in progress. Please try again shortly.")
+    try:
+        info = await probe_link(link, session_id, mode)
+        if missing_formats(info):
+            info = await probe_link(link, session_id, mode, refresh=True)
+    except PlatformUnavailable as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        logger.error(f"Failed to resolve {link} for streaming in session {session_id}: {str(e)}")
+        raise HTTPException(status_code=502, detail="Failed to resolve the video link. Please try again.")
+
+    user_downloads_dir = os.path.join(DOWNLOAD_FOLDER, session_id)
+    tee_path = None
+    if save:
+        await asyncio.to_thread(os.makedirs, user_downloads_dir, exist_ok=True)
+        tee_path = os.path.join(user_downloads_dir, f".stream-{uuid.uuid4().hex}.part")
+    stream = PassThrough(info, ydl_opts.get("cookiefile"), tee_path)
+    platform = get_platform(link)
+    await stream_slots.acquire()
+    metrics.IN_FLIGHT.inc(platform)
+
+    async def release():
+        await stream.close()
+        stream_slots.release()
+        metrics.IN_FLIGHT.dec(platform)
+
+    async def body():
+        try:
+            async for chunk in stream.chunks():
+                yield chunk
+            metrics.DOWNLOADED_BYTES.inc(platform, stream.size)
+            await stream.close()
+            if save:
+                await keep_streamed_copy(stream, key, link, session_id)
+            logger.info(f"Streamed {link} ({stream.size} bytes) for session {session_id}")
+        except StreamError as e:
+            # Headers are already sent; the client sees a truncated body
+            logger.error(f"Streaming {link} failed for session {session_id}: {str(e)}")
+        finally:
+            await release()
+
+    # Until the response is handed back, body() hasn't started and can't clean up after us
+    try:
+        await stream.start()
+        logger.info(f"Streaming {link} as {stream.filename} for session {session_id}")
+        return StreamingResponse(
+            body(),
+            media_type=stream.media_type,
+            headers={"Content-Disposition": attachment_header(stream.filename), "Cache-Control": "no-store"},
+        )
+    except Exception as e:
+        await release()
+        logger.error(f"Failed to start streaming {link} in session {session_id}: {str(e)}")
+        raise HTTPException(status_code=502, detail="Failed to stream the video. Please try again.")
+
+def zip_response(session_id: str, filenames: List[str], archive_name: str) -> StreamingResponse:
+    entries = [(functools.partial(storage.open, session_id, name), name) for name in filenames]
+    return StreamingResponse(
+        iter_zip(entries),
+        media_type="application/zip",
+        headers={"Content-Disposition": attachment_header(archive_name)},
+    )
+
+@router.get("/downloads/zip/")
+async def download_zip(session_id: str = Depends(get_session_id)):
+    files = await session_files(session_id)
+    if not files:
+        raise HTTPException(status_code=404, detail="No downloaded files to archive")
+    logger.info(f"Streaming ZIP of {len(files)} files for session {session_id}")
+    return zip_response(session_id, [f["name"] for f in files], "downloads.zip")
+
+@router.get("/jobs/{job_id}/zip")
+async def download_job_zip(job_id: str, session_id: str = Depends(get_session_id)):
+    job = await job_manager.get(job_id, session_id, include_links=False)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    filenames = sorted({
+        item["filename"]
+        async for item in files_collection.find({"session_id": session_id, "job_id": job_id}, {"_id": 0, "filename": 1})
+    })
+    if not filenames:
+        raise HTTPException(status_code=404, detail="No downloaded files to archive")
+    logger.info(f"Streaming ZIP of {len(filenames)} files for job {job_id} in session {session_id}")
+    return zip_response(session_id, filenames, f"job-{job_id}.zip")
+
+HISTORY_FIELDS = {"link": 1, "status": 1, "error": 1, "created_at": 1}
+
+# Paged, newest first, when limit or cursor is given; otherwise the whole history in the
+# order it was recorded, as clients written before paging expect
+@router.get("/downloads/history/")
+async def get_download_history(limit: int = Query(None), cursor: str = Query(None), session_id: str = Depends(get_session_id)):
+    try:
+        if limit is None and cursor is None:
+            downloads = [item async for item in downloads_collection.find({"session_id": session_id}, {**HISTORY_FIELDS, "_id": 0}).sort("_id", 1)]
+            next_cursor = None
+        else:
+            downloads, next_cursor = await find_page(downloads_collection, {"session_id": session_id}, HISTORY_FIELDS, PAGE_SIZE if limit is None else limit, cursor)
+        logger.info(f"Fetched download history with {len(downloads)} entries for session {session_id}")
+        return {"downloads": downloads, "next_cursor": next_cursor}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error fetching download history for session {session_id}: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to fetch download history. Please try again.")
 
-@app.delete("/downloads/clear-history/")
+@router.delete("/downloads/clear-history/")
 async def clear_download_history(session_id: str = Depends(get_session_id)):
     try:
         await downloads_collection.delete_many({"session_id": session_id})
@@ -387,18 +879,61 @@ async def clear_download_history(session_id: str = Depends(get_session_id)):
         logger.error(f"Error clearing download history for session {session_id}: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to clear download history. Please try again.")
 
-@app.get("/test-download/")
+@router.get("/test-download/")
 async def test_download(session_id: str = Depends(get_session_id)):
     links = ["https://www.instagram.com/reel/DHLxrgdo0lM/?igsh=dnVvbHBhcTdlNW94"]
     try:
-        cleanup_downloads_folder(session_id)
+        await storage_index.enforce_quota(session_id)
         results = await download_videos(links, session_id)
-        logger.info(f"Completed test download with {len(results)} results for session {session_id}: {results}")
+        logger.info(f"Completed test download with {len(results)} results for session {session_id}")
         return {"results": results}
     except Exception as e:
         logger.error(f"Error in test download for session {session_id}: {str(e)}")
         raise HTTPException(status_code=500, detail="Failed to perform test download. Please try again.")
 
+# Capability probes and database setup, run in the background so the server answers
+# /healthz right away; /readyz reports ready once MongoDB and ffmpeg check out. The job
+# queue starts claiming once MongoDB answers, and yt-dlp is imported last, so the first
+# download doesn't pay for loading its extractors.
+async def boot_checks():
+    await readiness.check_ffmpeg()
+    await readiness.wait_for_mongo(db, db.connect if isinstance(db, LazyDatabase) else None)
+    try:
+        await metadata_cache.ensure_indexes()
+        await ensure_indexes(db)
+        await job_manager.ensure_indexes()
+    except Exception as e:
+        logger.error(f"Failed to create MongoDB indexes: {str(e)}")
+    await start_jobs()
+    await asyncio.to_thread(load_ytdlp)
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await start_scheduler()
+    run_in_background(boot_checks(), "boot checks")
+    yield
+    for task in list(background_tasks):
+        task.cancel()
+    await shutdown_jobs()
+    await shutdown_scheduler()
+
+def create_app() -> FastAPI:
+    app = FastAPI(lifespan=lifespan)
+    # CORS first, so the session middleware wraps it
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=origins,
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    app.add_middleware(SessionCookieMiddleware)
+    app.add_exception_handler(HTTPException, http_exception_handler)
+    app.include_router(router)
+    return app
+
+app = create_app()
+
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("PORT", 8000))
@@ -0,0 +1,94 @@
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+import json
+import logging
+import os
+import time
+from urls import normalize_url
+
+logger = logging.getLogger(__name__)
+
+METADATA_TTL = int(os.getenv("METADATA_TTL", 900))  # seconds; format URLs from most sites expire within hours
+METADATA_CACHE_ENTRIES = int(os.getenv("METADATA_CACHE_ENTRIES", 2048))
+PROBE_WORKERS = int(os.getenv("PROBE_WORKERS", 16))
+MAX_SESSION_PROBES = int(os.getenv("MAX_SESSION_PROBES", 8))
+
+
+# Short summary of a probed info dict for API responses
+def info_summary(info: dict) -> dict:
+    requested = info.get("requested_formats") or [info]
+    sizes = [f.get("filesize") or f.get("filesize_approx") for f in requested]
+    return {
+        "title": info.get("title"),
+        "duration": info.get("duration"),
+        "extractor": info.get("extractor_key"),
+        "id": info.get("id"),
+        "format_id": info.get("format_id"),
+        "ext": info.get("ext"),
+        "filesize": sum(sizes) if all(sizes) else None,
+    }
+
+
+# TTL cache of yt-dlp info dicts, keyed by normalized URL and format spec. A bounded
+# in-process LRU sits in front of a MongoDB collection whose TTL index expires entries, so
+# every worker shares the probes.
+class MetadataCache:
+    def __init__(self, collection, ttl: int = METADATA_TTL, max_entries: int = METADATA_CACHE_ENTRIES):
+        self.collection = collection
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (expires_at monotonic, info)
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(link: str, format_spec: str) -> str:
+        return f"{normalize_url(link)}|{format_spec}"
+
+    async def ensure_indexes(self):
+        await self.collection.create_index("expires_at", expireAfterSeconds=0)
+
+    async def get(self, link: str, format_spec: str):
+        key = self._key(link, format_spec)
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            del self._entries[key]
+        try:
+            doc = await self.collection.find_one({"_id": key, "expires_at": {"$gt": datetime.now(timezone.utc)}})
+        except Exception as e:
+            logger.warning(f"Failed to read cached metadata for {link}: {str(e)}")
+            self.misses += 1
+            return None
+        if doc is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        info = json.loads(doc["info"])
+        remaining = (doc["expires_at"].replace(tzinfo=timezone.utc) - datetime.now(timezone.utc)).total_seconds()
+        self._remember(key, info, remaining)
+        return info
+
+    async def put(self, link: str, format_spec: str, info: dict):
+        key = self._key(link, format_spec)
+        self._remember(key, info, self.ttl)
+        try:
+            await self.collection.replace_one(
+                {"_id": key},
+                {"info": json.dumps(info), "expires_at": datetime.now(timezone.utc) + timedelta(seconds=self.ttl)},
+                upsert=True,
+            )
+        except Exception as e:
+            logger.warning(f"Failed to store metadata for {link}: {str(e)}")
+
+    def _remember(self, key: str, info: dict, ttl: float):
+        self._entries[key] = (time.monotonic() + ttl, info)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
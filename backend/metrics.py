@@ -0,0 +1,146 @@
+from contextlib import contextmanager
+import bisect
+import threading
+import time
+
+# Upper bounds, in seconds, of the stage timing buckets
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+# Minimal metric types rendered in the Prometheus text format. Values are keyed by label
+# values and guarded by a lock, since worker threads update them too.
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help_text: str, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels) -> tuple:
+        if isinstance(labels, str):
+            labels = (labels,)
+        if len(labels) != len(self.labels):
+            raise ValueError(f"{self.name} expects labels {self.labels}")
+        return tuple(labels)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, labels=(), amount: float = 1):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, labels=(), value: float = 0):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, labels=(), amount: float = 1):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, labels=(), amount: float = 1):
+        self.inc(labels, -amount)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help_text: str, labels=(), buckets=STAGE_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets) + (float("inf"),)
+
+    def observe(self, labels=(), value: float = 0):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            state[0][bisect.bisect_left(self.buckets, value)] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, labels=()):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(labels, time.perf_counter() - started)
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets, counts):
+                    cumulative += bucket_count
+                    le = 'le="' + _format_value(float(bound)) + '"'
+                    lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(total)}")
+                lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {count}")
+        return lines
+
+
+STAGE_SECONDS = Histogram(
+    "downloader_stage_seconds",
+    "Time spent per download stage: metadata, transfer, merge, postprocess, rename, mongo_write",
+    labels=("stage",),
+)
+DOWNLOADS = Counter("downloader_downloads_total", "Finished link downloads", labels=("platform", "status"))
+DOWNLOADED_BYTES = Counter("downloader_downloaded_bytes_total", "Bytes fetched from platforms (cache misses only)", labels=("platform",))
+IN_FLIGHT = Gauge("downloader_in_flight", "Downloads currently running on this worker", labels=("platform",))
+QUEUE_DEPTH = Gauge("downloader_queue_depth", "Work waiting or running, by queue", labels=("queue", "state"))
+CACHE_REQUESTS = Gauge("downloader_cache_requests", "Cache lookups since start, by cache and result", labels=("cache", "result"))
+CACHE_HIT_RATIO = Gauge("downloader_cache_hit_ratio", "Share of cache lookups served from the cache", labels=("cache",))
+CIRCUIT_OPEN = Gauge("downloader_circuit_open", "1 while a platform's circuit breaker is not closed", labels=("platform",))
+PLATFORM_RATE = Gauge("downloader_platform_rate", "Current request rate allowed per platform (per second)", labels=("platform",))
+
+REGISTRY = [STAGE_SECONDS, DOWNLOADS, DOWNLOADED_BYTES, IN_FLIGHT, QUEUE_DEPTH, CACHE_REQUESTS, CACHE_HIT_RATIO, CIRCUIT_OPEN, PLATFORM_RATE]
+
+
+def record_cache(cache: str, hits: int, misses: int):
+    CACHE_REQUESTS.set((cache, "hit"), hits)
+    CACHE_REQUESTS.set((cache, "miss"), misses)
+    CACHE_HIT_RATIO.set((cache,), hits / (hits + misses) if hits + misses else 0.0)
+
+
+def render() -> str:
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,135 @@
+from contextlib import ExitStack
+import asyncio
+import json
+import logging
+import mimetypes
+import os
+import sys
+import tempfile
+from downloader import sanitize_filename, private_cookiefile
+
+logger = logging.getLogger(__name__)
+
+STREAM_CHUNK_SIZE = int(os.getenv("STREAM_CHUNK_SIZE", 256 * 1024))
+MAX_STREAMS = int(os.getenv("MAX_STREAMS", 8))  # pass-through downloads running at once on this worker
+STDERR_TAIL = 4096  # bytes of a failed process's stderr kept for the error message
+
+
+class StreamError(Exception):
+    pass
+
+
+def _ffmpeg_headers(headers: dict) -> str:
+    return "".join(f"{name}: {value}\r\n" for name, value in (headers or {}).items())
+
+
+# A split video+audio selection whose formats are missing from the info dict, e.g. one
+# cached before probes kept them. yt-dlp would mux it to stdout as MPEG-TS, not MP4.
+def missing_formats(info: dict) -> bool:
+    return "+" in (info.get("format_id") or "") and len(info.get("requested_formats") or []) < 2
+
+
+# Command that writes the selected format(s) of a probed info dict to stdout. Split
+# video+audio formats are stream-copied by ffmpeg into a fragmented MP4, which needs no
+# seeking; a single format is piped by yt-dlp from the cached info, without resolving the
+# page again. Returns (argv, extension).
+def stream_command(info: dict, info_path: str, cookiefile: str = None) -> tuple:
+    if missing_formats(info):
+        raise StreamError(f"Format {info['format_id']} is split but the probe has no requested formats")
+    requested = info.get("requested_formats") or []
+    if len(requested) > 1:
+        argv = ["ffmpeg", "-hide_banner", "-loglevel", "error", "-nostdin"]
+        for fmt in requested:
+            argv += ["-headers", _ffmpeg_headers(fmt.get("http_headers")), "-i", fmt["url"]]
+        argv += [
+            "-map", "0:v:0", "-map", "1:a:0", "-c", "copy",
+            "-f", "mp4", "-movflags", "frag_keyframe+empty_moov+default_base_moof", "pipe:1",
+        ]
+        return argv, "mp4"
+    argv = [
+        sys.executable, "-m", "yt_dlp", "--quiet", "--no-warnings", "--no-progress",
+        "--load-info-json", info_path, "-f", info.get("format_id") or "best", "-o", "-",
+    ]
+    if cookiefile:
+        argv += ["--cookies", cookiefile]
+    return argv, info.get("ext") or "mp4"
+
+
+# One pass-through download. start() spawns the process and waits for the first bytes, so
+# a failure can still be reported as an HTTP error; chunks() then yields the output as it
+# is produced, writing a copy to tee_path when given. The copy is kept only if the process
+# finished cleanly; close() removes it otherwise and always reaps the process.
+class PassThrough:
+    def __init__(self, info: dict, cookiefile: str = None, tee_path: str = None):
+        self.info = info
+        self.cookiefile = cookiefile
+        self.tee_path = tee_path
+        self.completed = False
+        self.size = 0
+        self._process = None
+        self._stderr = None
+        self._first = b""
+        self._tee = None
+        self._info_path = None
+        self._resources = ExitStack()
+        base = sanitize_filename(info.get("title") or info.get("id") or "video") or "video"
+        self.ext = "mp4"
+        self.filename = f"{base}.{self.ext}"
+
+    @property
+    def media_type(self) -> str:
+        return mimetypes.guess_type(self.filename)[0] or "application/octet-stream"
+
+    async def start(self):
+        fd, self._info_path = tempfile.mkstemp(suffix=".info.json")
+        with os.fdopen(fd, "w") as f:
+            json.dump(self.info, f)
+        cookiefile = self._resources.enter_context(private_cookiefile(self.cookiefile))
+        argv, self.ext = stream_command(self.info, self._info_path, cookiefile)
+        self.filename = f"{os.path.splitext(self.filename)[0]}.{self.ext}"
+        self._process = await asyncio.create_subprocess_exec(
+            *argv, stdin=asyncio.subprocess.DEVNULL, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+        )
+        self._stderr = asyncio.create_task(self._process.stderr.read())
+        self._first = await self._process.stdout.read(STREAM_CHUNK_SIZE)
+        if not self._first:
+            await self._process.wait()
+            raise StreamError(await self._error())
+        if self.tee_path:
+            self._tee = await asyncio.to_thread(open, self.tee_path, "wb")
+
+    async def _error(self) -> str:
+        stderr = (await self._stderr)[-STDERR_TAIL:].decode(errors="replace").strip()
+        return stderr or f"exited with status {self._process.returncode}"
+
+    async def chunks(self):
+        chunk = self._first
+        self._first = b""
+        while chunk:
+            if self._tee is not None:
+                await asyncio.to_thread(self._tee.write, chunk)
+            self.size += len(chunk)
+            yield chunk
+            chunk = await self._process.stdout.read(STREAM_CHUNK_SIZE)
+        if await self._process.wait() != 0:
+            raise StreamError(await self._error())
+        self.completed = True
+
+    async def close(self):
+        if self._process is not None and self._process.returncode is None:
+            self._process.kill()
+            await self._process.wait()
+        if self._stderr is not None and not self._stderr.done():
+            self._stderr.cancel()
+        if self._tee is not None:
+            await asyncio.to_thread(self._tee.close)
+            self._tee = None
+            if not self.completed:
+                await asyncio.to_thread(os.remove, self.tee_path)
+        if self._info_path is not None:
+            try:
+                os.remove(self._info_path)
+            except FileNotFoundError:
+                pass
+            self._info_path = None
+        self._resources.close()
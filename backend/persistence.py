@@ -0,0 +1,120 @@
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import ASCENDING, DESCENDING, InsertOne
+from pymongo.errors import BulkWriteError
+import asyncio
+import logging
+import os
+from metrics import STAGE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+WRITE_BATCH_SIZE = int(os.getenv("WRITE_BATCH_SIZE", 200))  # operations per bulk_write
+WRITE_FLUSH_INTERVAL = float(os.getenv("WRITE_FLUSH_INTERVAL", 0.05))  # seconds a write waits for company
+PAGE_SIZE = int(os.getenv("PAGE_SIZE", 100))
+MAX_PAGE_SIZE = int(os.getenv("MAX_PAGE_SIZE", 500))
+
+# (collection name, keys) created at startup
+INDEXES = [
+    ("links", [("session_id", ASCENDING), ("position", ASCENDING)]),
+    ("downloads", [("session_id", ASCENDING), ("_id", DESCENDING)]),
+    ("downloads", [("created_at", ASCENDING)]),
+    ("files", [("session_id", ASCENDING), ("_id", DESCENDING)]),
+    ("files", [("session_id", ASCENDING), ("job_id", ASCENDING)]),
+    ("files", [("created_at", ASCENDING)]),
+    ("jobs", [("session_id", ASCENDING), ("created_at", DESCENDING)]),
+]
+
+
+async def ensure_indexes(db):
+    for name, keys in INDEXES:
+        await db[name].create_index(keys)
+    logger.info(f"Ensured {len(INDEXES)} MongoDB indexes")
+
+
+# Buffers write operations for one collection and sends them as unordered bulk_write
+# batches. Callers still await their own write: concurrent downloads share a round trip
+# instead of each paying for one, and a failed write raises in the caller that made it.
+class BatchWriter:
+    def __init__(self, collection, batch_size: int = WRITE_BATCH_SIZE, flush_interval: float = WRITE_FLUSH_INTERVAL):
+        self.collection = collection
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._pending = []  # (operation, future)
+        self._timer = None
+        self._flushing = set()  # running flush tasks, kept referenced until done
+
+    async def write(self, operation):
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((operation, future))
+        if len(self._pending) >= self.batch_size:
+            self._flush_now()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.flush_interval, self._flush_now)
+        return await future
+
+    async def insert(self, document: dict):
+        return await self.write(InsertOne(document))
+
+    def _flush_now(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.create_task(self._flush(batch))
+            self._flushing.add(task)
+            task.add_done_callback(self._flushing.discard)
+
+    async def _flush(self, batch: list):
+        try:
+            with STAGE_SECONDS.time("mongo_write"):
+                await self.collection.bulk_write([operation for operation, _ in batch], ordered=False)
+        except BulkWriteError as e:
+            failed = {error["index"]: error.get("errmsg", "write failed") for error in e.details.get("writeErrors", [])}
+            logger.error(f"{len(failed)} of {len(batch)} writes to {self.collection.name} failed")
+            for index, (_, future) in enumerate(batch):
+                if not future.done():
+                    if index in failed:
+                        future.set_exception(Exception(failed[index]))
+                    else:
+                        future.set_result(None)
+            return
+        except Exception as e:
+            logger.error(f"Bulk write of {len(batch)} operations to {self.collection.name} failed: {str(e)}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for _, future in batch:
+            if not future.done():
+                future.set_result(None)
+
+    # Send whatever is buffered and wait for writes in progress, e.g. on shutdown
+    async def flush(self):
+        self._flush_now()
+        if self._flushing:
+            await asyncio.gather(*self._flushing, return_exceptions=True)
+
+
+def page_limit(limit: int) -> int:
+    return max(1, min(limit or PAGE_SIZE, MAX_PAGE_SIZE))
+
+
+# One page of documents, newest first, continuing after the given cursor (an _id from the
+# previous page). Uses the (session_id, _id) indexes, so every page costs the same however
+# far back it is. Returns (documents without _id, next cursor or None).
+async def find_page(collection, query: dict, projection: dict, limit: int = PAGE_SIZE, cursor: str = None):
+    limit = page_limit(limit)
+    query = dict(query)
+    if cursor:
+        try:
+            query["_id"] = {"$lt": ObjectId(cursor)}
+        except InvalidId:
+            raise ValueError(f"Invalid cursor: {cursor}")
+    projection = {**projection, "_id": 1}
+    documents = [doc async for doc in collection.find(query, projection).sort("_id", DESCENDING).limit(limit + 1)]
+    next_cursor = str(documents[limit - 1]["_id"]) if len(documents) > limit else None
+    for doc in documents:
+        doc.pop("_id")
+    return documents[:limit], next_cursor
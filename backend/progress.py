@@ -0,0 +1,44 @@
+from contextlib import contextmanager
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+SUBSCRIBER_QUEUE_SIZE = 256
+
+
+def session_channel(session_id: str) -> str:
+    return f"session:{session_id}"
+
+
+def job_channel(job_id: str) -> str:
+    return f"job:{job_id}"
+
+
+# In-process fan-out of download progress events to WebSocket subscribers. publish must be
+# called on the event loop; worker threads and processes reach it through the scheduler's
+# event queue.
+class ProgressBroker:
+    def __init__(self):
+        self._subscribers = {}  # channel -> set of asyncio.Queue
+
+    @contextmanager
+    def subscribe(self, channel: str):
+        events = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self._subscribers.setdefault(channel, set()).add(events)
+        try:
+            yield events
+        finally:
+            subscribers = self._subscribers.get(channel)
+            if subscribers is not None:
+                subscribers.discard(events)
+                if not subscribers:
+                    del self._subscribers[channel]
+
+    def publish(self, channels, event: dict):
+        for channel in channels:
+            for events in self._subscribers.get(channel, ()):
+                if events.full():
+                    # A slow client only loses the oldest updates, never blocks the publisher
+                    events.get_nowait()
+                events.put_nowait(event)
@@ -0,0 +1,197 @@
+import asyncio
+import logging
+import os
+import random
+import re
+import time
+
+logger = logging.getLogger(__name__)
+
+# Starting request rate (per second), burst size and yt-dlp retry budget per platform.
+# Rates adapt between rate / 16 and rate * 2 as the platform throttles or recovers.
+PLATFORM_LIMITS = {
+    "instagram": {"rate": 0.5, "burst": 3, "retries": 3},
+    "youtube": {"rate": 4.0, "burst": 8, "retries": 5},
+    "x": {"rate": 1.0, "burst": 4, "retries": 4},
+    "unknown": {"rate": 4.0, "burst": 8, "retries": 5},
+}
+BREAKER_THRESHOLD = int(os.getenv("BREAKER_THRESHOLD", 5))  # consecutive throttle/block errors that open the circuit
+BREAKER_COOLDOWN = float(os.getenv("BREAKER_COOLDOWN", 60))  # seconds, doubled on every failed probe
+BREAKER_MAX_COOLDOWN = float(os.getenv("BREAKER_MAX_COOLDOWN", 900))
+MAX_BACKOFF = float(os.getenv("MAX_BACKOFF", 120))
+
+# Only errors about the platform treating us as a whole count. Matching bare words would
+# also hit video IDs ("C4293xk") and errors about one video, such as geo-blocks or age
+# gates, and every false match slows the whole platform down.
+THROTTLE_MARKERS = re.compile(
+    r"http error 429\b|too many requests|rate limit exceeded|rate-limit reached|please wait a few minutes"
+)
+BLOCK_MARKERS = re.compile(r"http error 403\b|sign in to confirm you.re not a bot|\bcheckpoint_required\b")
+
+
+class PlatformUnavailable(Exception):
+    pass
+
+
+# "throttled", "blocked", or None for failures that are about the video itself
+def classify_error(error) -> str:
+    message = str(error).lower()
+    if THROTTLE_MARKERS.search(message):
+        return "throttled"
+    if BLOCK_MARKERS.search(message):
+        return "blocked"
+    return None
+
+
+# Token bucket whose refill rate is tuned by AIMD: a throttle halves the rate and pauses
+# the bucket for an exponentially growing, jittered backoff; each success adds back a
+# little rate.
+class AdaptiveTokenBucket:
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.min_rate = rate / 16
+        self.max_rate = rate * 2
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.backoff = 1.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def on_success(self):
+        self.rate = min(self.max_rate, self.rate + self.min_rate)
+        self.backoff = 1.0
+
+    def on_throttle(self):
+        self._refill(time.monotonic())
+        self.rate = max(self.min_rate, self.rate / 2)
+        self.tokens = 0
+        self.paused_until = time.monotonic() + self.backoff * random.uniform(0.5, 1.5)
+        self.backoff = min(MAX_BACKOFF, self.backoff * 2)
+
+
+# Fails fast once a platform keeps throttling or blocking us. After the cooldown a single
+# probe request is let through; its outcome closes the circuit or reopens it for longer.
+class CircuitBreaker:
+    def __init__(self, threshold: int = BREAKER_THRESHOLD, cooldown: float = BREAKER_COOLDOWN):
+        self.threshold = threshold
+        self.base_cooldown = cooldown
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.probe_started = 0.0
+
+    def allow(self) -> bool:
+        if self.opened_at is None:
+            return True
+        now = time.monotonic()
+        # A probe that never reported back (cancelled, crashed) is given up after a cooldown
+        if self.probing and now - self.probe_started < self.cooldown:
+            return False
+        if not self.probing and now - self.opened_at < self.cooldown:
+            return False
+        self.probing = True
+        self.probe_started = now
+        return True
+
+    def retry_after(self) -> float:
+        if self.opened_at is None:
+            return 0.0
+        return max(0.0, self.cooldown - (time.monotonic() - self.opened_at))
+
+    def on_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.cooldown = self.base_cooldown
+
+    def on_failure(self):
+        self.failures += 1
+        if self.probing:
+            self.cooldown = min(BREAKER_MAX_COOLDOWN, self.cooldown * 2)
+            self.opened_at = time.monotonic()
+            self.probing = False
+        elif self.opened_at is None and self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+
+    def on_neutral(self):
+        # The platform answered; the failure was about the video itself
+        if self.probing:
+            self.on_success()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "half_open" if self.probing else "open"
+
+
+class PlatformLimiter:
+    def __init__(self, limits: dict = PLATFORM_LIMITS):
+        self.limits = limits
+        self._buckets = {}
+        self._breakers = {}
+
+    def _limits(self, platform: str) -> dict:
+        return self.limits.get(platform, self.limits["unknown"])
+
+    def retries(self, platform: str) -> int:
+        return self._limits(platform)["retries"]
+
+    def _bucket(self, platform: str) -> AdaptiveTokenBucket:
+        if platform not in self._buckets:
+            limits = self._limits(platform)
+            self._buckets[platform] = AdaptiveTokenBucket(limits["rate"], limits["burst"])
+        return self._buckets[platform]
+
+    def _breaker(self, platform: str) -> CircuitBreaker:
+        return self._breakers.setdefault(platform, CircuitBreaker())
+
+    async def acquire(self, platform: str):
+        breaker = self._breaker(platform)
+        if not breaker.allow():
+            raise PlatformUnavailable(
+                f"{platform} is temporarily refusing downloads, retry in {int(breaker.retry_after()) + 1}s"
+            )
+        await self._bucket(platform).acquire()
+
+    def record(self, platform: str, error=None):
+        bucket, breaker = self._bucket(platform), self._breaker(platform)
+        kind = classify_error(error) if error is not None else None
+        if error is None:
+            bucket.on_success()
+            breaker.on_success()
+        elif kind == "throttled":
+            bucket.on_throttle()
+            breaker.on_failure()
+            logger.warning(f"{platform} is throttling us, rate lowered to {bucket.rate:.2f}/s")
+        elif kind == "blocked":
+            breaker.on_failure()
+        else:
+            breaker.on_neutral()
+        if breaker.state == "open" and breaker.failures == breaker.threshold:
+            logger.error(f"Circuit opened for {platform} after {breaker.failures} consecutive failures")
+
+    def stats(self) -> dict:
+        return {
+            platform: {"rate": round(self._bucket(platform).rate, 3), "circuit": self._breaker(platform).state}
+            for platform in self._buckets
+        }
@@ -0,0 +1,115 @@
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from contextlib import asynccontextmanager
+import asyncio
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Scheduler configuration, overridable through the environment
+DOWNLOAD_EXECUTOR = os.getenv("DOWNLOAD_EXECUTOR", "thread")  # "thread" or "process"
+DOWNLOAD_WORKERS = int(os.getenv("DOWNLOAD_WORKERS", 8))
+MAX_CONCURRENT_DOWNLOADS = int(os.getenv("MAX_CONCURRENT_DOWNLOADS", DOWNLOAD_WORKERS))
+MAX_SESSION_DOWNLOADS = int(os.getenv("MAX_SESSION_DOWNLOADS", 4))
+
+
+# Runs blocking download jobs on a worker pool, off the event loop. Jobs are admitted
+# through a global limit and a per-session limit, so one large batch can't starve
+# every other session of workers.
+class DownloadScheduler:
+    def __init__(self, kind: str = DOWNLOAD_EXECUTOR, workers: int = DOWNLOAD_WORKERS,
+                 max_concurrent: int = MAX_CONCURRENT_DOWNLOADS, max_per_session: int = MAX_SESSION_DOWNLOADS):
+        if kind not in ("thread", "process"):
+            raise ValueError(f"Unknown executor kind: {kind}")
+        self.kind = kind
+        self.workers = workers
+        self.max_per_session = max_per_session
+        self._global_slots = asyncio.Semaphore(max_concurrent)
+        self._session_slots = {}  # session_id -> [semaphore, number of jobs holding or waiting on it]
+        self._executor = None
+        self._manager = None
+        self._pump = None
+        self._loop = None
+        self.queued = 0
+        self.running = 0
+        # Workers put (channels, event) tuples on this queue; they are handed to on_event
+        # on the event loop. It is a Manager queue in process mode so it can be pickled.
+        self.events = None
+        self.on_event = None
+
+    def start(self):
+        if self._executor is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        if self.kind == "process":
+            # spawn keeps the Mongo client and event loop threads out of the workers
+            context = multiprocessing.get_context("spawn")
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+            self._manager = context.Manager()
+            self.events = self._manager.Queue()
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="download")
+            self.events = queue.SimpleQueue()
+        self._pump = threading.Thread(target=self._pump_events, name="download-events", daemon=True)
+        self._pump.start()
+        logger.info(f"Download scheduler started with {self.workers} {self.kind} workers")
+
+    def shutdown(self, wait: bool = True):
+        if self._executor is None:
+            return
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+        self._executor = None
+        self.events.put(None)
+        self._pump.join(timeout=5)
+        if self._manager is not None:
+            self._manager.shutdown()
+            self._manager = None
+        logger.info("Download scheduler stopped")
+
+    def _pump_events(self):
+        while True:
+            try:
+                item = self.events.get()
+            except (EOFError, OSError):
+                break
+            if item is None:
+                break
+            if self.on_event is not None:
+                try:
+                    self._loop.call_soon_threadsafe(self.on_event, *item)
+                except RuntimeError:
+                    break  # event loop already closed
+
+    @asynccontextmanager
+    async def _session_slot(self, session_id: str):
+        entry = self._session_slots.setdefault(session_id, [asyncio.Semaphore(self.max_per_session), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                self._session_slots.pop(session_id, None)
+
+    # Queue fn(*args) for session_id and wait for its result
+    async def run(self, session_id: str, fn, *args):
+        self.start()
+        self.queued += 1
+        admitted = False
+        try:
+            async with self._session_slot(session_id), self._global_slots:
+                self.queued -= 1
+                admitted = True
+                self.running += 1
+                try:
+                    loop = asyncio.get_running_loop()
+                    return await loop.run_in_executor(self._executor, fn, *args)
+                finally:
+                    self.running -= 1
+        finally:
+            if not admitted:
+                self.queued -= 1
@@ -0,0 +1,120 @@
+from email.utils import formatdate, parsedate_to_datetime
+from fastapi import Request, Response
+from fastapi.responses import FileResponse
+from starlette.datastructures import Headers
+from urllib.parse import quote
+import hashlib
+import io
+import logging
+import mimetypes
+import os
+import zipfile
+
+logger = logging.getLogger(__name__)
+
+FILE_CHUNK_SIZE = int(os.getenv("FILE_CHUNK_SIZE", 1024 * 1024))  # bytes per read when streaming files
+ZIP_CHUNK_SIZE = int(os.getenv("ZIP_CHUNK_SIZE", 1024 * 1024))
+CACHE_CONTROL = "private, no-cache"  # let browsers keep files but revalidate them with a cheap 304
+
+
+# FileResponse keeps Range/If-Range handling (206 and multipart ranges) from Starlette.
+# When the server offers the ASGI pathsend extension, whole-file responses are handed to it
+# so the server can use sendfile; otherwise files are read in large chunks.
+class VideoFileResponse(FileResponse):
+    chunk_size = FILE_CHUNK_SIZE
+
+    async def __call__(self, scope, receive, send):
+        extensions = scope.get("extensions") or {}
+        headers = Headers(scope=scope)
+        if "http.response.pathsend" in extensions and scope["method"].upper() != "HEAD" and "range" not in headers:
+            await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+            await send({"type": "http.response.pathsend", "path": os.fspath(self.path)})
+            if self.background is not None:
+                await self.background()
+            return
+        await super().__call__(scope, receive, send)
+
+
+# Same validators as Starlette's FileResponse, so the ETag we compare is the one we sent
+def file_validators(stat_result: os.stat_result):
+    etag_base = str(stat_result.st_mtime) + "-" + str(stat_result.st_size)
+    etag = f'"{hashlib.md5(etag_base.encode(), usedforsecurity=False).hexdigest()}"'
+    return etag, formatdate(stat_result.st_mtime, usegmt=True)
+
+
+def _not_modified(request: Request, etag: str, stat_result: os.stat_result) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return "*" in tags or etag in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is not None:
+        try:
+            return int(stat_result.st_mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+# Content-Disposition for a download, with non-ASCII names in RFC 5987 form as FileResponse does
+def attachment_header(filename: str) -> str:
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"attachment; filename*=utf-8''{quoted}"
+    return f'attachment; filename="{filename}"'
+
+
+def file_response(request: Request, file_path: str, stat_result: os.stat_result, filename: str) -> Response:
+    etag, last_modified = file_validators(stat_result)
+    if _not_modified(request, etag, stat_result):
+        return Response(status_code=304, headers={"ETag": etag, "Last-Modified": last_modified, "Cache-Control": CACHE_CONTROL})
+    media_type = mimetypes.guess_type(filename)[0] or "video/mp4"
+    return VideoFileResponse(
+        file_path,
+        media_type=media_type,
+        filename=filename,
+        stat_result=stat_result,
+        headers={"Cache-Control": CACHE_CONTROL},
+    )
+
+
+# Write-only, unseekable sink; zipfile falls back to data descriptors for it, so an archive
+# can be produced front to back without ever holding more than one chunk.
+class _ZipSink(io.RawIOBase):
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+# Generate a ZIP of (open, arcname) pairs chunk by chunk, where open() returns a readable
+# binary file from whichever storage backend holds it. Videos are already compressed, so
+# entries are stored rather than deflated. Files that disappear mid-way are skipped.
+def iter_zip(entries):
+    sink = _ZipSink()
+    with zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_STORED, allowZip64=True) as archive:
+        for opener, arcname in entries:
+            try:
+                source = opener()
+            except FileNotFoundError:
+                logger.warning(f"Skipping missing file {arcname} in ZIP download")
+                continue
+            with source, archive.open(arcname, mode="w", force_zip64=True) as target:
+                while True:
+                    chunk = source.read(ZIP_CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    target.write(chunk)
+                    yield sink.drain()
+            yield sink.drain()
+    yield sink.drain()
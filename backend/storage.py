@@ -0,0 +1,127 @@
+import logging
+import os
+import shutil
+import stat
+
+logger = logging.getLogger(__name__)
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local")  # "local" or "s3"
+S3_BUCKET = os.getenv("S3_BUCKET", "")
+S3_PREFIX = os.getenv("S3_PREFIX", "downloads")
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL") or None  # e.g. a local MinIO for development
+S3_URL_EXPIRY = int(os.getenv("S3_URL_EXPIRY", 3600))  # seconds a presigned download link stays valid
+
+
+# Finished files per session in a directory tree: root/<session_id>/<filename>. Downloads
+# already land in that tree, so saving is a no-op unless the file comes from elsewhere.
+class LocalStorage:
+    def __init__(self, root: str):
+        self.root = root
+
+    def path(self, session_id: str, filename: str) -> str:
+        return os.path.join(self.root, session_id, filename)
+
+    def save(self, session_id: str, filename: str, src_path: str):
+        dest = self.path(session_id, filename)
+        if os.path.abspath(src_path) != os.path.abspath(dest):
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            shutil.move(src_path, dest)
+
+    def scan(self, session_id: str) -> dict:
+        files = {}
+        user_downloads_dir = os.path.join(self.root, session_id)
+        os.makedirs(user_downloads_dir, exist_ok=True)
+        for entry in os.scandir(user_downloads_dir):
+            if entry.is_file():
+                stat_result = entry.stat()
+                files[entry.name] = [stat_result.st_size, stat_result.st_mtime]
+        return files
+
+    def stat(self, session_id: str, filename: str) -> os.stat_result:
+        return os.stat(self.path(session_id, filename))
+
+    def open(self, session_id: str, filename: str):
+        return open(self.path(session_id, filename), "rb")
+
+    def delete(self, session_id: str, filename: str):
+        try:
+            os.remove(self.path(session_id, filename))
+        except FileNotFoundError:
+            pass
+
+    # Local files are streamed by the API itself
+    def url(self, session_id: str, filename: str):
+        return None
+
+
+# Finished files in an S3-compatible bucket under prefix/<session_id>/<filename>, so every
+# worker and node sees the same files. Downloads still land on local disk first and are
+# moved to the bucket once complete; clients fetch them through presigned URLs.
+class S3Storage:
+    def __init__(self, bucket: str = S3_BUCKET, prefix: str = S3_PREFIX, endpoint_url: str = S3_ENDPOINT_URL):
+        import boto3
+
+        if not bucket:
+            raise ValueError("S3_BUCKET must be set to use the s3 storage backend")
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        self.client = boto3.client("s3", endpoint_url=endpoint_url)
+
+    def key(self, session_id: str, filename: str) -> str:
+        return "/".join(part for part in (self.prefix, session_id, filename) if part)
+
+    def save(self, session_id: str, filename: str, src_path: str):
+        self.client.upload_file(src_path, self.bucket, self.key(session_id, filename))
+        os.remove(src_path)
+
+    def scan(self, session_id: str) -> dict:
+        files = {}
+        prefix = self.key(session_id, "")
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            for item in page.get("Contents", []):
+                name = item["Key"][len(prefix):]
+                if name and "/" not in name:
+                    files[name] = [item["Size"], item["LastModified"].timestamp()]
+        return files
+
+    def stat(self, session_id: str, filename: str) -> os.stat_result:
+        from botocore.exceptions import ClientError
+
+        try:
+            head = self.client.head_object(Bucket=self.bucket, Key=self.key(session_id, filename))
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                raise FileNotFoundError(filename)
+            raise
+        mtime = head["LastModified"].timestamp()
+        return os.stat_result((stat.S_IFREG | 0o644, 0, 0, 1, 0, 0, head["ContentLength"], mtime, mtime, mtime))
+
+    def open(self, session_id: str, filename: str):
+        try:
+            return self.client.get_object(Bucket=self.bucket, Key=self.key(session_id, filename))["Body"]
+        except self.client.exceptions.NoSuchKey:
+            raise FileNotFoundError(filename)
+
+    def delete(self, session_id: str, filename: str):
+        self.client.delete_object(Bucket=self.bucket, Key=self.key(session_id, filename))
+
+    def url(self, session_id: str, filename: str) -> str:
+        return self.client.generate_presigned_url(
+            "get_object",
+            Params={
+                "Bucket": self.bucket,
+                "Key": self.key(session_id, filename),
+                "ResponseContentDisposition": f'attachment; filename="{filename}"',
+            },
+            ExpiresIn=S3_URL_EXPIRY,
+        )
+
+
+def create_storage(root: str, backend: str = STORAGE_BACKEND):
+    if backend == "s3":
+        logger.info(f"Storing downloads in S3 bucket {S3_BUCKET} ({S3_ENDPOINT_URL or 'AWS'})")
+        return S3Storage()
+    if backend != "local":
+        raise ValueError(f"Unknown storage backend '{backend}'. Use 'local' or 's3'.")
+    return LocalStorage(root)
@@ -0,0 +1,149 @@
+import asyncio
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+MAX_SESSION_BYTES = int(os.getenv("MAX_SESSION_BYTES", 5 * 1024 * 1024 * 1024))  # 5GB limit per user
+JANITOR_INTERVAL = int(os.getenv("JANITOR_INTERVAL", 300))  # seconds between idle-session sweeps
+INDEX_IDLE_SECONDS = int(os.getenv("INDEX_IDLE_SECONDS", 3600))  # drop untouched sessions from memory after this
+
+MEDIA_EXTENSIONS = (".mp4", ".m4a", ".mp3", ".opus", ".ogg", ".webm")
+
+
+# In-memory index of each session's stored files: sizes, modification times and the running
+# byte total. A session is listed from the storage backend once, on first use; after that it
+# is kept current as downloads land and files are evicted, so quota checks and listings
+# never touch the backend. Eviction happens on a background janitor task, which awaits
+# on_evict(session_id, filename), when set, for every file it deletes. Storage may be shared
+# by several workers, so reserve() also awaits claim_name(session_id, filename), when set,
+# which returns False for a name another worker already holds.
+class StorageIndex:
+    def __init__(self, storage, max_session_bytes: int = MAX_SESSION_BYTES):
+        self.storage = storage
+        self.max_session_bytes = max_session_bytes
+        self._sessions = {}  # session_id -> {"files": {name: [size, mtime]}, "size": int, "touched": float}
+        self._loading = {}  # session_id -> asyncio.Task scanning the directory
+        self._pending = set()  # sessions waiting for the janitor
+        self._wakeup = asyncio.Event()
+        self._janitor = None
+        self.on_evict = None
+        self.claim_name = None
+
+    def _scan(self, session_id: str) -> dict:
+        files = self.storage.scan(session_id)
+        return {"files": files, "size": sum(size for size, _ in files.values())}
+
+    async def _load(self, session_id: str) -> dict:
+        state = self._sessions.get(session_id)
+        if state is None:
+            task = self._loading.get(session_id)
+            if task is None:
+                task = asyncio.create_task(asyncio.to_thread(self._scan, session_id))
+                self._loading[session_id] = task
+            try:
+                scanned = await asyncio.shield(task)
+            finally:
+                self._loading.pop(session_id, None)
+            state = self._sessions.setdefault(session_id, scanned)
+        state["touched"] = time.monotonic()
+        return state
+
+    async def record(self, session_id: str, filename: str, size: int):
+        state = await self._load(session_id)
+        old = state["files"].get(filename)
+        if old is not None:
+            state["size"] -= old[0]
+        state["files"][filename] = [size, time.time()]
+        state["size"] += size
+        if state["size"] > self.max_session_bytes:
+            self.request_cleanup(session_id)
+
+    # A name no stored or incoming file of the session has: the given one, or the same
+    # with _2, _3... before the extension. It is taken right away, so concurrent downloads
+    # of videos with the same title never land on the same file.
+    async def reserve(self, session_id: str, filename: str) -> str:
+        state = await self._load(session_id)
+        base, ext = os.path.splitext(filename)
+        name, number = filename, 1
+        while name in state["files"] or (self.claim_name is not None and not await self.claim_name(session_id, name)):
+            number += 1
+            name = f"{base}_{number}{ext}"
+        state["files"][name] = [0, time.time()]
+        return name
+
+    def forget(self, session_id: str, filename: str):
+        state = self._sessions.get(session_id)
+        if state is not None:
+            old = state["files"].pop(filename, None)
+            if old is not None:
+                state["size"] -= old[0]
+
+    async def usage(self, session_id: str) -> int:
+        return (await self._load(session_id))["size"]
+
+    async def list_files(self, session_id: str) -> list:
+        state = await self._load(session_id)
+        return [
+            {"name": name, "size": size}
+            for name, (size, _) in state["files"].items()
+            if name.endswith(MEDIA_EXTENSIONS)
+        ]
+
+    # O(1) quota check; sessions over their quota are handed to the janitor
+    async def enforce_quota(self, session_id: str) -> bool:
+        over = await self.usage(session_id) > self.max_session_bytes
+        if over:
+            self.request_cleanup(session_id)
+        return over
+
+    def request_cleanup(self, session_id: str):
+        self._pending.add(session_id)
+        self._wakeup.set()
+
+    def start(self):
+        if self._janitor is None:
+            self._janitor = asyncio.create_task(self._run_janitor())
+
+    def shutdown(self):
+        if self._janitor is not None:
+            self._janitor.cancel()
+            self._janitor = None
+
+    async def _run_janitor(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=JANITOR_INTERVAL)
+            except asyncio.TimeoutError:
+                self._drop_idle()
+            self._wakeup.clear()
+            while self._pending:
+                session_id = self._pending.pop()
+                try:
+                    await self._evict(session_id)
+                except Exception as e:
+                    logger.error(f"Error during downloads folder cleanup for user {session_id}: {str(e)}")
+
+    def _drop_idle(self):
+        cutoff = time.monotonic() - INDEX_IDLE_SECONDS
+        idle = [sid for sid, state in self._sessions.items() if state["touched"] < cutoff and sid not in self._pending]
+        for session_id in idle:
+            del self._sessions[session_id]
+        if idle:
+            logger.info(f"Dropped {len(idle)} idle sessions from the storage index")
+
+    # Delete the session's oldest files until it is back under quota
+    async def _evict(self, session_id: str):
+        state = await self._load(session_id)
+        if state["size"] <= self.max_session_bytes:
+            return
+        logger.info(f"User {session_id} downloads folder size ({state['size']} bytes) exceeds limit ({self.max_session_bytes} bytes). Cleaning up...")
+        for name, (size, _) in sorted(state["files"].items(), key=lambda item: item[1][1]):
+            await asyncio.to_thread(self.storage.delete, session_id, name)
+            self.forget(session_id, name)
+            logger.info(f"Deleted {name} ({size} bytes) for user {session_id}")
+            if self.on_evict is not None:
+                await self.on_evict(session_id, name)
+            if state["size"] <= self.max_session_bytes:
+                break
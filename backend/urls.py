@@ -0,0 +1,62 @@
+from functools import lru_cache
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+from downloader import load_ytdlp
+
+# Click trackers dropped from links to any host. The platforms keep nothing but the video
+# (or playlist) id anyway; other hosts keep the rest, since their parameters can matter.
+TRACKING_PARAMS = {"fbclid", "gclid"}
+
+HOST_ALIASES = {
+    "youtu.be": "youtube.com",
+    "twitter.com": "x.com",
+    "mobile.twitter.com": "x.com",
+}
+PLATFORM_HOSTS = {"youtube.com", "instagram.com", "x.com"}
+
+
+def normalize_url(link: str) -> str:
+    parts = urlsplit(link.strip())
+    host = (parts.hostname or "").lower()
+    for prefix in ("www.", "m.", "mobile."):
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+    path = parts.path.rstrip("/")
+    query = [(k, v) for k, v in parse_qsl(parts.query) if k not in TRACKING_PARAMS and not k.startswith("utm_")]
+
+    if host == "youtu.be" and path:
+        query = [("v", path.lstrip("/"))]
+        path = "/watch"
+    elif host == "youtube.com" and path.startswith("/shorts/"):
+        query = [("v", path[len("/shorts/"):])]
+        path = "/watch"
+    if host == "youtube.com":
+        # A playlist page is identified by its list; anywhere else only the video counts
+        keep = "list" if path == "/playlist" else "v"
+        query = [(k, v) for k, v in query if k == keep]
+    elif host in ("instagram.com", "x.com", "twitter.com"):
+        query = []
+    host = HOST_ALIASES.get(host, host)
+
+    # The platforms we know are HTTPS-only; any other host keeps its scheme and port
+    if host in PLATFORM_HOSTS:
+        return urlunsplit(("https", host, path, urlencode(sorted(query)), ""))
+    scheme = parts.scheme.lower() or "https"
+    port = parts.port
+    if port is not None and (scheme, port) not in (("http", 80), ("https", 443)):
+        host = f"{host}:{port}"
+    return urlunsplit((scheme, host, path, urlencode(sorted(query)), ""))
+
+
+# Identify the video a link points at without touching the network, using the URL
+# patterns of yt-dlp's extractors. Falls back to the normalized URL for links only the
+# generic extractor would handle.
+@lru_cache(maxsize=4096)
+def video_identity(link: str) -> str:
+    normalized = normalize_url(link)
+    for ie in load_ytdlp().extractor.gen_extractor_classes():
+        if ie.ie_key() != "Generic" and ie.suitable(normalized):
+            video_id = ie.get_temp_id(normalized)
+            if video_id:
+                return f"{ie.ie_key()}:{video_id}"
+            break
+    return f"url:{normalized}"
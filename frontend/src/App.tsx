@@ -13,6 +13,22 @@ interface FileInfo {
   size: number; // Size in bytes
 }
 
+interface JobLink {
+  link: string;
+  status: string; // queued, running, done or failed
+  error?: string;
+}
+
+interface Job {
+  job_id: string;
+  status: string;
+  total: number;
+  counts: { queued: number; running: number; done: number; failed: number };
+  links?: JobLink[];
+}
+
+const JOB_POLL_INTERVAL = 2000; // ms between job status checks
+
 // Dynamically set the API base URL based on the environment
 const API_BASE_URL =
   process.env.NODE_ENV === "development"
@@ -47,7 +63,32 @@ const App: React.FC = () => {
   const [loadingClearHistory, setLoadingClearHistory] = useState(false);
   const [error, setError] = useState<string | null>(null);
   const [downloadedFiles, setDownloadedFiles] = useState<FileInfo[]>([]);
-  const [progress, setProgress] = useState<{ current: number; total: number; link: string; status: string } | null>(null);
+  const [progress, setProgress] = useState<{ current: number; total: number; status: string } | null>(null);
+
+  // Downloads run as a job on the server; poll its status instead of holding one request
+  // open until every download finishes, which proxies time out on long batches
+  const waitForJob = async (jobId: string, onUpdate?: (job: Job) => void): Promise<DownloadResult[]> => {
+    for (;;) {
+      const response = await axios.get<Job>(`${API_BASE_URL}/jobs/${jobId}`, {
+        withCredentials: true,
+      });
+      const job = response.data;
+      onUpdate?.(job);
+      if (job.status === "done" || job.status === "failed") {
+        break;
+      }
+      await new Promise((resolve) => setTimeout(resolve, JOB_POLL_INTERVAL));
+    }
+    const response = await axios.get<Job>(`${API_BASE_URL}/jobs/${jobId}`, {
+      params: { include_links: true },
+      withCredentials: true,
+    });
+    return (response.data.links || []).map((item) =>
+      item.status === "done"
+        ? { link: item.link, status: "success" }
+        : { link: item.link, status: "failed", error: item.error || `Download ${item.status}` }
+    );
+  };
 
   const fetchDownloadedFiles = async () => {
     try {
@@ -141,24 +182,20 @@ const App: React.FC = () => {
       });
       console.log("Excel uploaded successfully:", uploadResponse.data);
 
-      // Use HTTP endpoint directly (WebSocket disabled)
-      console.log("Calling download-all endpoint:", `${API_BASE_URL}/download-all/`);
-      const response = await axios.post(`${API_BASE_URL}/download-all/`, {}, {
+      console.log("Submitting download-all job:", `${API_BASE_URL}/jobs/download-all/`);
+      const response = await axios.post<Job>(`${API_BASE_URL}/jobs/download-all/`, {}, {
         withCredentials: true,
       });
-      console.log("HTTP download response:", response.data);
-      setBulkResults(response.data.results);
-
-      const total = response.data.results.length;
-      for (let i = 0; i < total; i++) {
+      console.log("Download job submitted:", response.data);
+      const results = await waitForJob(response.data.job_id, (job) => {
         setProgress({
-          current: i + 1,
-          total: total,
-          link: response.data.results[i].link,
-          status: response.data.results[i].status,
+          current: job.counts.done + job.counts.failed,
+          total: job.total,
+          status: `${job.counts.done} done, ${job.counts.failed} failed, ${job.counts.running} running`,
         });
-        await new Promise((resolve) => setTimeout(resolve, 500));
-      }
+      });
+      console.log("Download job results:", results);
+      setBulkResults(results);
 
       fetchDownloadedFiles();
       fetchHistory();
@@ -185,11 +222,13 @@ const App: React.FC = () => {
     setSingleResult(null);
 
     try {
-      const response = await axios.post(`${API_BASE_URL}/download-single/?link=${encodeURIComponent(singleLink)}`, {}, {
+      const response = await axios.post<Job>(`${API_BASE_URL}/jobs/download-single/?link=${encodeURIComponent(singleLink)}`, {}, {
         withCredentials: true,
       });
-      console.log("Single video download response:", response.data);
-      setSingleResult(response.data.results[0]);
+      console.log("Single video download job submitted:", response.data);
+      const results = await waitForJob(response.data.job_id);
+      console.log("Single video download results:", results);
+      setSingleResult(results[0]);
       fetchDownloadedFiles();
       fetchHistory();
     } catch (err: any) {
@@ -205,14 +244,13 @@ const App: React.FC = () => {
   };
 
   const handleDownloadAllFiles = () => {
-    downloadedFiles.forEach((file) => {
-      const link = document.createElement("a");
-      link.href = `${API_BASE_URL}/downloads/file/${encodeURIComponent(file.name)}`;
-      link.download = file.name;
-      document.body.appendChild(link);
-      link.click();
-      document.body.removeChild(link);
-    });
+    // One streamed ZIP instead of a request per file
+    const link = document.createElement("a");
+    link.href = `${API_BASE_URL}/downloads/zip/`;
+    link.download = "downloads.zip";
+    document.body.appendChild(link);
+    link.click();
+    document.body.removeChild(link);
   };
 
   const toggleHistory = () => {
@@ -247,7 +285,7 @@ const App: React.FC = () => {
           <p style={{ color: "#666", marginBottom: "10px" }}>Upload Excel file with video_link column</p>
           <input
             type="file"
-            accept=".xlsx"
+            accept=".xlsx,.csv"
             onChange={handleFileChange}
             disabled={loadingBulk}
             style={{ display: "none" }}
@@ -288,7 +326,7 @@ const App: React.FC = () => {
         {progress && (
           <div style={{ marginTop: "20px" }}>
             <p>
-              Downloading {progress.current} of {progress.total}: {progress.link} ({progress.status}) -{" "}
+              Downloaded {progress.current} of {progress.total} ({progress.status}) -{" "}
               {((progress.current / progress.total) * 100).toFixed(1)}%
             </p>
             <div style={{ backgroundColor: "#eee", borderRadius: "5px", height: "10px" }}>